@@ -13,23 +13,156 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import hashlib
+import json
+import ntpath
+import os
 import socket
+import tempfile
+import textwrap
+import threading
 import urlparse
+import zipfile
 
 
 from argus.action_manager import base
 from argus import exceptions
+from argus import resources_server
 from argus import util
 import requests
+import six
 from winrm import exceptions as winrm_exceptions
 
 LOG = util.LOG
 
+# Where the resource bundle is extracted on the instance.
+BUNDLE_DIR = r"C:\argus\resources"
+BUNDLE_ZIP = r"C:\argus_resources.zip"
+# Where the scripts are cached on the instance, by their SHA-256 hash.
+SCRIPT_CACHE_DIR = r"C:\argus\cache"
+
+# Print the SHA-256 hash of a cached script, if it exists,
+# creating the cache directory otherwise.
+CACHED_SCRIPT_HASH = textwrap.dedent("""
+    if (Test-Path '{path}') {{
+        $source = [IO.File]::OpenRead('{path}')
+        try {{
+            $hash = [Security.Cryptography.SHA256]::Create().ComputeHash(
+                $source)
+        }} finally {{
+            $source.Dispose()
+        }}
+        [BitConverter]::ToString($hash).Replace('-', '').ToLower()
+    }} else {{
+        [void](New-Item -ItemType Directory -Force '{directory}')
+    }}
+""")
+
 
 class WindowsActionManager(base.BaseActionManager):
 
     def __init__(self, client, config, os_type=util.WINDOWS):
         super(WindowsActionManager, self).__init__(client, config, os_type)
+        # The resources available in the bundle, by resource location.
+        self._bundled = {}
+        # The remote paths of the scripts known to be cached.
+        self._cached_scripts = set()
+
+    def push_resource_bundle(self, resource_locations):
+        """Copy the given resources on the instance, with a single transfer.
+
+        The resources are packed in a zip, which is copied on the
+        instance and extracted there. The next calls of
+        :meth:`download_resource` and of the methods executing resource
+        scripts use the extracted files for these resources. If the
+        bundle can't be pushed, the resources are downloaded as usual.
+
+        :param resource_locations:
+            Paths relative to the /argus/resources/ directory.
+        """
+        LOG.info("Pushing a bundle of %d resources.", len(resource_locations))
+        cmd = ("Add-Type -A System.IO.Compression.FileSystem; "
+               "if (Test-Path '{0}') {{ Remove-Item -Recurse -Force '{0}' }}; "
+               "[IO.Compression.ZipFile]::ExtractToDirectory('{1}', '{0}'); "
+               "Remove-Item -Force '{1}'".format(BUNDLE_DIR, BUNDLE_ZIP))
+        fd, bundle = tempfile.mkstemp(suffix=".zip")
+        os.close(fd)
+        try:
+            with zipfile.ZipFile(bundle, "w", zipfile.ZIP_DEFLATED) as stream:
+                for resource_location in resource_locations:
+                    stream.writestr(resource_location,
+                                    util.get_resource(resource_location))
+            self._client.copy_file(bundle, BUNDLE_ZIP)
+            self._client.run_command_with_retry(
+                cmd, command_type=util.POWERSHELL,
+                policy=_no_command_retry())
+        except exceptions.ArgusError as exc:
+            LOG.warning("Could not push the resource bundle, the "
+                        "resources will be downloaded instead: %s", exc)
+            return
+        finally:
+            os.remove(bundle)
+
+        for resource_location in resource_locations:
+            self._bundled[resource_location] = ntpath.join(
+                BUNDLE_DIR, *resource_location.split('/'))
+
+    def cache_script(self, content, extension=".ps1"):
+        """Store the given script on the instance, if it isn't already there.
+
+        The script is kept in the cache directory, under the SHA-256
+        hash of its content, so the same script is uploaded only once,
+        no matter how many times it is executed.
+
+        :returns: The path of the script on the instance.
+        """
+        if isinstance(content, six.text_type):
+            content = content.encode("utf-8")
+        digest = hashlib.sha256(content).hexdigest()
+        remote_script = ntpath.join(SCRIPT_CACHE_DIR, digest + extension)
+        if remote_script in self._cached_scripts:
+            return remote_script
+
+        cmd = CACHED_SCRIPT_HASH.format(path=remote_script,
+                                        directory=SCRIPT_CACHE_DIR)
+        stdout, _, _ = self._client.run_command_with_retry(
+            cmd, command_type=util.POWERSHELL, policy=_no_command_retry())
+        if stdout.strip() != digest:
+            # Either missing or left incomplete by a failed upload.
+            fd, path = tempfile.mkstemp(suffix=extension)
+            try:
+                with os.fdopen(fd, "wb") as stream:
+                    stream.write(content)
+                self._client.copy_file(path, remote_script)
+            finally:
+                os.remove(path)
+        else:
+            LOG.debug("The script %s is already cached.", remote_script)
+        self._cached_scripts.add(remote_script)
+        return remote_script
+
+    def cache_resource_script(self, resource_location):
+        """Store the given resource script on the instance.
+
+        :param resource_location:
+            Path relative to the /argus/resources/ directory.
+        :returns: The path of the script on the instance.
+        """
+        if resource_location in self._bundled:
+            return self._bundled[resource_location]
+        _, extension = os.path.splitext(resource_location)
+        return self.cache_script(util.get_resource(resource_location),
+                                 extension=extension)
+
+    def clear_script_cache(self):
+        """Remove all the scripts cached on the instance."""
+        LOG.info("Removing the scripts cached in %s.", SCRIPT_CACHE_DIR)
+        cmd = ("if (Test-Path '{0}') {{ Remove-Item -Recurse -Force '{0}' }}"
+               .format(SCRIPT_CACHE_DIR))
+        self._client.run_command_with_retry(
+            cmd, count=util.RETRY_COUNT, delay=util.RETRY_DELAY,
+            command_type=util.POWERSHELL)
+        self._cached_scripts.clear()
 
     def download(self, uri, location):
         """Download the resource locatet at a specific uri in the location.
@@ -57,10 +190,23 @@ class WindowsActionManager(base.BaseActionManager):
         :param location:
             The location on the instance.
         """
+        if resource_location in self._bundled:
+            LOG.debug("Copying the bundled %s to %s",
+                      resource_location, location)
+            cmd = "Copy-Item -Force '{}' '{}'".format(
+                self._bundled[resource_location], location)
+            self._client.run_command_with_retry(
+                cmd, command_type=util.POWERSHELL,
+                policy=_no_command_retry())
+            return
+
         base_resource = self._conf.argus.resources
+        if self._conf.argus.serve_resources:
+            base_resource = resources_server.get_url(
+                self._conf.argus.resources_port,
+                self._conf.argus.resources_host)
         if not base_resource.endswith("/"):
-            base_resource = urlparse.urljoin(self._conf.argus.resources,
-                                             "resources/")
+            base_resource = urlparse.urljoin(base_resource, "resources/")
         uri = urlparse.urljoin(base_resource, resource_location)
         self.download(uri, location)
 
@@ -73,8 +219,11 @@ class WindowsActionManager(base.BaseActionManager):
         if script_type == util.BAT_SCRIPT:
             script_type = util.CMD
 
-        instance_location = r"C:\{}".format(resource_location.split('/')[-1])
-        self.download_resource(resource_location, instance_location)
+        instance_location = self._bundled.get(resource_location)
+        if instance_location is None:
+            instance_location = r"C:\{}".format(
+                resource_location.split('/')[-1])
+            self.download_resource(resource_location, instance_location)
         cmd = "{} {}".format(instance_location, parameters)
         self._client.run_command_with_retry(cmd,
                                             count=util.RETRY_COUNT,
@@ -157,6 +306,23 @@ class WindowsActionManager(base.BaseActionManager):
         LOG.info("Wait for the machine to finish rebooting ...")
         self.wait_boot_completion()
 
+    def flush_volume_cache(self, drive_letter="C"):
+        """Write the data cached for the given volume to the disk.
+
+        :returns:
+            ``False`` if the cache can't be flushed, because
+            Write-VolumeCache is missing, which is the case
+            before Windows 8 and Windows Server 2012.
+        """
+        LOG.debug("Flushing the cache of the volume %s:", drive_letter)
+        cmd = ("if (Get-Command Write-VolumeCache "
+               "-ErrorAction SilentlyContinue) {{ "
+               "Write-VolumeCache -DriveLetter {}; $true }} "
+               "else {{ $false }}".format(drive_letter))
+        stdout, _, _ = self._client.run_command_with_retry(
+            cmd, command_type=util.POWERSHELL, policy=_no_command_retry())
+        return stdout.strip() == "True"
+
     def git_clone(self, repo_url, location):
         """Clone from an remote repo to a specific location on the instance.
 
@@ -174,14 +340,9 @@ class WindowsActionManager(base.BaseActionManager):
 
     def wait_cbinit_service(self):
         """Wait if the CloudBase Init Service to stop."""
-        wait_cmd = ('(Get-Service | where -Property Name '
-                    '-match cloudbase-init).Status')
-
-        self._client.run_command_until_condition(
-            wait_cmd,
-            lambda out: out.strip() == 'Stopped',
-            retry_count=util.RETRY_COUNT, delay=util.RETRY_DELAY,
-            command_type=util.POWERSHELL)
+        condition = ('(Get-Service | where -Property Name '
+                     '-match cloudbase-init).Status -eq "Stopped"')
+        self._client.wait_until(condition)
 
     def check_cbinit_service(self, searched_paths=None):
         """Check if the CloudBase Init service started.
@@ -190,28 +351,21 @@ class WindowsActionManager(base.BaseActionManager):
             Paths to files that should exist if the hearbeat patch is
             aplied.
         """
-        test_cmd = 'Test-Path {}'
-        check_cmds = [test_cmd.format(path) for path in searched_paths or []]
-        for check_cmd in check_cmds:
-            self._client.run_command_until_condition(
-                check_cmd,
-                lambda out: out.strip() == 'True',
-                retry_count=util.RETRY_COUNT, delay=util.RETRY_DELAY,
-                command_type=util.POWERSHELL)
+        if not searched_paths:
+            return
+        condition = " -and ".join('(Test-Path {})'.format(path)
+                                  for path in searched_paths)
+        self._client.wait_until(condition)
 
     def wait_boot_completion(self):
         """Wait for a resonable amount of time the instance to boot."""
         LOG.info("Waiting for boot completion...")
 
         username = self._conf.openstack.image_username
-        wait_cmd = ('(Get-WmiObject Win32_Account | '
-                    'where -Property Name -contains {0}).Name'
-                    .format(username))
-        self._client.run_command_until_condition(
-            wait_cmd,
-            lambda stdout: stdout.strip() == username,
-            retry_count=util.RETRY_COUNT, delay=util.RETRY_DELAY,
-            command_type=util.POWERSHELL)
+        condition = ('(Get-WmiObject Win32_Account | '
+                     'where -Property Name -contains {0}).Name -eq "{0}"'
+                     .format(username))
+        self._client.wait_until(condition)
 
     def specific_prepare(self):
         """Prepare some OS specific resources."""
@@ -245,6 +399,35 @@ class WindowsNanoActionManager(WindowsSever2016ActionManager):
         super(WindowsNanoActionManager, self).__init__(client, config, os_type)
 
 
+# Wait for the image user to be available, then print the version,
+# the product type and whether the OS is a Nano Server, as JSON.
+OS_PROBE_SCRIPT = textwrap.dedent("""
+    $deadline = [DateTime]::UtcNow.AddSeconds(%(timeout)d)
+    while ([DateTime]::UtcNow -lt $deadline) {
+        try {
+            $account = Get-WmiObject Win32_Account |
+                where -Property Name -contains '{username}'
+            if ($account) { break }
+        } catch {}
+        Start-Sleep -Seconds 1
+    }
+    $os = Get-WmiObject -Class Win32_OperatingSystem
+    $key = ('HKLM:Software\\Microsoft\\Windows NT\\CurrentVersion' +
+            '\\Server\\ServerLevels')
+    $nano = (Test-Path $key) -and ((Get-ItemProperty $key).NanoServer -eq 1)
+    '{"major": ' + [Environment]::OSVersion.Version.Major +
+    ', "product_type": ' + $os.ProductType +
+    ', "nano": ' + $nano.ToString().ToLower() + '}'
+""") % {"timeout": util.RETRY_COUNT * util.RETRY_DELAY}
+# How long the OS detection tries to reach the instance, which can
+# still be booting, or rebooting during the specialize pass of a
+# fresh image.
+PROBE_TIMEOUT = 2 * util.RETRY_COUNT * util.RETRY_DELAY
+
+# The OS types detected for the instances, by instance ID.
+_OS_TYPES = {}
+_OS_TYPES_LOCK = threading.Lock()
+
 WindowsActionManagers = {
     util.WINDOWS: WindowsNanoActionManager,
     util.WINDOWS8: Windows8ActionManager,
@@ -255,86 +438,101 @@ WindowsActionManagers = {
 }
 
 
-def _is_nanoserver(client):
-    """Returns True if the client is connected to a nanoserver machine.
+def _retry_policy(**kwargs):
+    """Get a :class:`argus.client.windows.RetryPolicy`."""
+    # argus.client.windows depends on this module.
+    from argus.client import windows  # pylint: disable=cyclic-import
+    return windows.RetryPolicy(**kwargs)
 
-       Using the powershell code from here: https://goo.gl/UD27SK
-    """
-    server_level_key = (r'HKLM:Software\Microsoft\Windows NT\CurrentVersion'
-                        r'\Server\ServerLevels')
 
-    cmd = r'Test-Path "{}"'.format(server_level_key)
-    path_exists, _, _ = client.run_command_with_retry(
-        cmd, count=util.RETRY_COUNT, delay=util.RETRY_DELAY,
-        command_type=util.POWERSHELL)
+def _no_command_retry():
+    """Get a retry policy for the commands whose result won't change.
 
-    if path_exists == "False":
-        return False
-
-    cmd = r'(Get-ItemProperty {}).NanoServer'.format(server_level_key)
-    nanoserver_property, _, _ = client.run_command_with_retry(
-        cmd, count=util.RETRY_COUNT, delay=util.RETRY_DELAY,
-        command_type=util.POWERSHELL)
-
-    return nanoserver_property == "1"
-
-
-def _get_major_version(client):
-    """Return the major version of the OS.
-
-    :param client:
-        A Windows Client.
+    These are retried only if they can't be run, not if they fail.
     """
-    cmd = r"[System.Environment]::OSVersion.Version.Major"
-    major_version, _, _ = client.run_command_with_retry(
-        cmd, count=util.RETRY_COUNT, delay=util.RETRY_DELAY,
-        command_type=util.POWERSHELL)
-    return int(major_version.strip())
+    return _retry_policy(retry_command_errors=False)
 
 
-def _get_product_type(client):
-    """Return the minor version of the OS.
+def _probe_os(client):
+    """Get the details needed for detecting the OS type, in one command.
 
-    :param client:
-        A Windows Client.
+    The command waits for the boot to complete, by waiting for the
+    image user to be available, and prints the details as JSON.
     """
-    cmd = r"(Get-WmiObject -Class Win32_OperatingSystem).producttype"
-    product_type, _, _ = client.run_command_with_retry(
-        cmd, count=util.RETRY_COUNT, delay=util.RETRY_DELAY,
-        command_type=util.POWERSHELL)
-    return int(product_type.strip())
-
+    conf = util.get_config()
+    script = OS_PROBE_SCRIPT.replace(
+        "{username}", conf.openstack.image_username)
+    policy = _retry_policy(count=None, deadline=PROBE_TIMEOUT)
+    stdout, _, _ = client.run_command_with_retry(
+        script, command_type=util.POWERSHELL, policy=policy)
+    return json.loads(stdout.strip().splitlines()[-1])
+
+
+def _load_os_types(path):
+    try:
+        with open(path) as stream:
+            return json.load(stream)
+    except (IOError, ValueError):
+        return {}
+
+
+def _remember_os_type(image_ref, os_type):
+    path = util.get_config().openstack.os_type_cache
+    if not path or not image_ref:
+        return
+    with _OS_TYPES_LOCK:
+        os_types = _load_os_types(path)
+        os_types[image_ref] = os_type
+        with open(path, 'w') as stream:
+            json.dump(os_types, stream, indent=4, sort_keys=True)
+
+
+def _get_known_os_type(instance_id, image_ref):
+    if instance_id in _OS_TYPES:
+        return _OS_TYPES[instance_id]
+    path = util.get_config().openstack.os_type_cache
+    if path and image_ref:
+        with _OS_TYPES_LOCK:
+            return _load_os_types(path).get(image_ref)
+
+
+def get_windows_os_type(client, instance_id=None):
+    """Get the type of the OS from the instance of the given client.
+
+    The OS type is remembered for the given instance ID and, if
+    the *os_type_cache* option is set, for the image of the instance,
+    so that it isn't detected again for new clients.
+    """
+    image_ref = util.get_config().openstack.image_ref
+    os_type = _get_known_os_type(instance_id, image_ref)
+    if os_type is not None:
+        LOG.debug("Using the known OS type %s.", os_type)
+        return os_type
 
-def get_windows_action_manager(client):
-    """Get the OS specific Action Manager."""
     LOG.info("Waiting for boot completion in order to select an "
              "Action Manager ...")
-
-    conf = util.get_config()
-    username = conf.openstack.image_username
-    wait_cmd = ('(Get-WmiObject Win32_Account | '
-                'where -Property Name -contains {0}).Name'
-                .format(username))
-    client.run_command_until_condition(
-        wait_cmd,
-        lambda stdout: stdout.strip() == username,
-        retry_count=util.RETRY_COUNT, delay=util.RETRY_DELAY,
-        command_type=util.POWERSHELL)
-
-    # get os type
-    product_type = _get_product_type(client)
-    major_version = _get_major_version(client)
-    windows_type = util.WINDOWS_VERSION.get((major_version, product_type),
-                                            util.WINDOWS)
-    is_nanoserver = _is_nanoserver(client)
-
-    if isinstance(windows_type, dict):
-        windows_type = windows_type[is_nanoserver]
+    details = _probe_os(client)
+    major_version = details["major"]
+    product_type = details["product_type"]
+    is_nanoserver = details["nano"]
+    os_type = util.WINDOWS_VERSION.get((major_version, product_type),
+                                       util.WINDOWS)
+    if isinstance(os_type, dict):
+        os_type = os_type[is_nanoserver]
 
     LOG.debug(("We got the OS type %s because we have the major Version : %d,"
-               "The product Type : %d, and IsNanoserver: %d"), windows_type,
+               "The product Type : %d, and IsNanoserver: %d"), os_type,
               major_version, product_type, is_nanoserver)
 
+    if instance_id is not None:
+        _OS_TYPES[instance_id] = os_type
+    _remember_os_type(image_ref, os_type)
+    return os_type
+
+
+def get_windows_action_manager(client, instance_id=None):
+    """Get the OS specific Action Manager."""
+    windows_type = get_windows_os_type(client, instance_id)
     action_manager = WindowsActionManagers[windows_type]
     conf = util.get_config()
     return action_manager(client=client, config=conf)
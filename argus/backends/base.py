@@ -18,6 +18,7 @@ import os
 
 import six
 
+from argus.backends import reaper
 from argus import util
 
 
@@ -62,6 +63,58 @@ class BaseBackend(object):
     def cleanup(self):
         """Destroy and cleanup the relevant resources created by :meth:`setup_instance`."""
 
+    def teardown(self):
+        """Clean up and forget the resources recorded in the journal.
+
+        Unlike :meth:`cleanup`, this can be called again if it fails,
+        continuing with the resources which weren't deleted yet.
+        """
+        self.cleanup()
+        journal = self._get_journal()
+        if journal:
+            journal.forget(self._journal_owner)
+
+    @classmethod
+    def reap(cls, resources):
+        """Delete the resources recorded by a backend of a crashed run.
+
+        The backends which don't override this don't record their
+        resources in the journal, since they couldn't be deleted.
+
+        :param resources:
+            A list of kind and ID pairs, as given to :meth:`_journal`.
+        """
+        raise NotImplementedError(
+            "%s can't delete the resources of crashed runs." % cls.__name__)
+
+    @classmethod
+    def _can_reap(cls):
+        return six.get_method_function(cls.reap) is not (
+            six.get_method_function(BaseBackend.reap))
+
+    @classmethod
+    def _backend_type(cls):
+        return "{}.{}".format(cls.__module__, cls.__name__)
+
+    @util.cached_property
+    def _journal_owner(self):
+        return util.rand_name(self._name or self.__class__.__name__)
+
+    def _get_journal(self):
+        directory = self._conf.argus.teardown_journal
+        return reaper.get_journal(directory) if directory else None
+
+    def _journal(self, kind, resource_id):
+        """Remember a resource in the teardown journal, if there is one.
+
+        The resources which are still in the journal when argus starts
+        again are deleted through :meth:`reap`.
+        """
+        journal = self._get_journal()
+        if journal and self._can_reap():
+            journal.record(self._journal_owner, self._backend_type(),
+                           kind, resource_id)
+
     @abc.abstractmethod
     def get_remote_client(self, **kwargs):
         """Get a remote client to the underlying instance."""
@@ -70,6 +123,23 @@ class BaseBackend(object):
     def remote_client(self):
         """An astract property which should return the default client."""
 
+    def use_image_cache(self, key):
+        """Boot the next instance from the image cached for *key*, if any.
+
+        Backends which can snapshot their instances override this,
+        along with :meth:`from_image_cache` and :meth:`save_image_cache`.
+
+        :returns: True if the instance will boot from a cached image.
+        """
+        return False
+
+    def from_image_cache(self):
+        """Check if the instance was booted from a cached image."""
+        return False
+
+    def save_image_cache(self):
+        """Cache the image of the instance, for the key given previously."""
+
 
 
 class CloudBackend(BaseBackend):
@@ -26,6 +26,14 @@ from argus.backends.tempest import manager as api_manager
 from argus import exceptions
 from argus import util
 
+with util.restore_excepthook():
+    try:
+        from tempest.lib import exceptions as lib_exc
+    except ImportError:
+        from tempest_lib import exceptions as lib_exc
+
+
+LOG = util.get_logger()
 
 OS_NOVA_RESOURCE = 'OS::Nova::Server'
 OS_NEUTRON_FLOATING_IP = "OS::Neutron::FloatingIP"
@@ -50,6 +58,7 @@ class BaseHeatBackend(base.CloudBackend):
         self._heat_client = client.heat_client(
             self._manager.primary_credentials())
         self._keypair = None
+        self._stack = None
 
     @staticmethod
     def _build_template(instance_name, key,
@@ -126,11 +135,13 @@ class BaseHeatBackend(base.CloudBackend):
             self._conf.openstack.image_ref)['name']
         flavor_name = self._manager.flavors_client.show_flavor(
             self._conf.openstack.flavor_ref)['flavor']['name']
+        self._journal("credentials", self._manager.credentials_record())
         self._keypair = self._manager.create_keypair(
             name=self.__class__.__name__)
 
         # Get network info.
         credentials = self._manager.primary_credentials()
+        self._journal("keypair", self._keypair.name)
         self._configure_networking(credentials)
         floating_network_id = credentials.router['external_gateway_info']['network_id']
         private_net_id = credentials.network['id']
@@ -148,21 +159,70 @@ class BaseHeatBackend(base.CloudBackend):
             'environment': {},
         }
 
+        self._journal("stack", self._name)
+        self._stack = self._name
         self._heat_client.stacks.create(**fields)
 
     def cleanup(self):
+        # Every resource is forgotten once it is deleted, so that
+        # the cleanup can be resumed if it fails midway.
         if self._keypair:
             self._keypair.destroy()
+            self._keypair = None
 
-        try:
-            self._heat_client.stacks.delete(stack_id=self._name)
-        finally:
-            self._delete_floating_ip()
-            self._manager.cleanup_credentials()
+        if self._stack:
+            try:
+                try:
+                    self._heat_client.stacks.delete(stack_id=self._stack)
+                except exc.HTTPNotFound:
+                    pass
+            finally:
+                self._delete_floating_ip()
+            self._stack = None
+
+        self._manager.cleanup_credentials()
+
+    @classmethod
+    def reap(cls, resources):
+        records = [resource_id for kind, resource_id in resources
+                   if kind == "credentials"]
+        if not records:
+            # They are recorded before anything is created with them.
+            return
+        with api_manager.reaper_manager(records[0]) as manager:
+            if manager is None:
+                return
+            heat_client = client.heat_client(manager.primary_credentials())
+            for kind, resource_id in resources:
+                if kind == "stack":
+                    LOG.info("Deleting the leaked stack %s.", resource_id)
+                    try:
+                        heat_client.stacks.delete(stack_id=resource_id)
+                    except exc.HTTPNotFound:
+                        pass
+                elif kind == "keypair" and not records[0]["dynamic"]:
+                    # The keypairs of dynamic credentials belong
+                    # to their user, which is deleted.
+                    LOG.info("Deleting the leaked keypair %s.", resource_id)
+                    try:
+                        manager.keypairs_client.delete_keypair(resource_id)
+                    except Exception as ex:  # pylint: disable=broad-except
+                        # Most likely, it was already deleted.
+                        LOG.warning("Could not delete the keypair %s: %s",
+                                    resource_id, ex)
 
     def _delete_floating_ip(self):
-        self._manager.floating_ips_client.delete_floating_ip(
-            self._floating_ip_resource['id'])
+        try:
+            floating_ip_id = self._floating_ip_resource['id']
+        except exceptions.ArgusError:
+            # The stack is gone, together with its floating IP.
+            return
+        try:
+            self._manager.floating_ips_client.delete_floating_ip(
+                floating_ip_id)
+        except lib_exc.NotFound:
+            # Deleted by a previous attempt.
+            return
         try:
             self._search_resource_until_status(OS_NEUTRON_FLOATING_IP,
                                                status=RESOURCE_DELETED_STATUS)
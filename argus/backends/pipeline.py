@@ -0,0 +1,114 @@
+# Copyright 2016 Cloudbase Solutions Srl
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Run steps concurrently, as soon as the steps they depend on are done."""
+
+import collections
+import sys
+import threading
+import time
+
+import six
+
+from argus import exceptions
+from argus import util
+
+
+LOG = util.get_logger()
+
+
+class Pipeline(object):
+    """Steps which run concurrently, each one after its requirements.
+
+    Every step runs in its own thread, as soon as all the steps it
+    requires have finished successfully. A step whose requirements
+    failed is skipped. :meth:`run` waits for all the steps and then
+    raises the error of the first step which failed, if any.
+
+    The time taken by each step is recorded in :attr:`timings`.
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._steps = collections.OrderedDict()
+        self.timings = collections.OrderedDict()
+
+    def add(self, name, function, requires=()):
+        """Add a step calling *function*, with no arguments.
+
+        :param requires:
+            The names of the steps which have to finish before this
+            one starts. They must have been added already.
+        """
+        if name in self._steps:
+            raise exceptions.ArgusError("Duplicated step %r." % name)
+        unknown = [step for step in requires if step not in self._steps]
+        if unknown:
+            raise exceptions.ArgusError(
+                "The step %r requires unknown steps %r." % (name, unknown))
+        self._steps[name] = (function, tuple(requires))
+
+    def __contains__(self, name):
+        return name in self._steps
+
+    def run(self):
+        """Run all the steps.
+
+        :returns: A dictionary with the results of the steps.
+        """
+        done = {name: threading.Event() for name in self._steps}
+        results = {}
+        errors = collections.OrderedDict()
+        start = time.time()
+
+        def run_step(name, function, requires):
+            try:
+                for requirement in requires:
+                    done[requirement].wait()
+                failed = [step for step in requires if step in errors]
+                if failed:
+                    LOG.debug("Skipping %s, since %s failed.", name, failed)
+                    errors[name] = None
+                    return
+                step_start = time.time()
+                try:
+                    results[name] = function()
+                except Exception:  # pylint: disable=broad-except
+                    errors[name] = sys.exc_info()
+                finally:
+                    self.timings[name] = time.time() - step_start
+            finally:
+                done[name].set()
+
+        threads = []
+        for name, (function, requires) in self._steps.items():
+            thread = threading.Thread(target=run_step,
+                                      args=(name, function, requires))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+
+        LOG.info("%s finished in %.2f seconds: %s", self._name,
+                 time.time() - start,
+                 ", ".join("{} {:.2f}s".format(name, duration)
+                           for name, duration in self.timings.items()))
+        for name, exc_info in errors.items():
+            if exc_info:
+                LOG.error("The step %s of %s failed: %r.",
+                          name, self._name, exc_info[1])
+                six.reraise(*exc_info)
+        return results
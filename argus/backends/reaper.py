@@ -0,0 +1,218 @@
+# Copyright 2016 Cloudbase Solutions Srl
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Clean up the backends in the background and sweep leaked resources."""
+
+import atexit
+import errno
+import glob
+import importlib
+import json
+import os
+import threading
+import time
+
+import six
+
+from argus import util
+
+
+LOG = util.get_logger()
+
+REAPER_WORKERS = 4
+REAPER_RETRY_COUNT = 5
+REAPER_RETRY_DELAY = 10
+
+
+def _is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as exc:
+        return exc.errno == errno.EPERM
+    return True
+
+
+class Journal(object):
+    """The resources created by the backends, persisted in a directory.
+
+    Every process writes its own file, named after its PID, holding
+    the resources of the backends which weren't cleaned up yet. The
+    files of the processes which aren't running anymore are left
+    behind by crashed runs, their resources being deleted by
+    :func:`sweep`.
+    """
+
+    def __init__(self, directory, pid=None):
+        self.path = os.path.join(directory,
+                                 "{}.json".format(pid or os.getpid()))
+        self._owners = {}
+        self._lock = threading.Lock()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def _save(self):
+        # Called with the lock held.
+        if not self._owners:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            return
+        temporary = self.path + ".tmp"
+        with open(temporary, "w") as stream:
+            json.dump(self._owners, stream)
+        os.rename(temporary, self.path)
+
+    def record(self, owner, backend_type, kind, resource_id):
+        """Remember a resource created by a backend.
+
+        :param owner: A unique name of the backend.
+        :param backend_type:
+            The dotted path of the backend class, whose
+            :meth:`reap` method can delete the resource.
+        """
+        with self._lock:
+            entry = self._owners.setdefault(
+                owner, {"backend": backend_type, "resources": []})
+            entry["resources"].append([kind, resource_id])
+            self._save()
+
+    def forget(self, owner):
+        """Forget the resources of a backend, after its cleanup."""
+        with self._lock:
+            if self._owners.pop(owner, None) is not None:
+                self._save()
+
+    def adopt(self, owners):
+        """Take over the resources recorded by another journal."""
+        with self._lock:
+            self._owners.update(owners)
+            self._save()
+
+
+@util.run_once
+def get_journal(directory):
+    """Get the journal of this process, kept in the given directory."""
+    return Journal(directory)
+
+
+def _import_backend(backend_type):
+    module, _, name = backend_type.rpartition(".")
+    return getattr(importlib.import_module(module), name)
+
+
+@util.run_once
+def sweep(directory):
+    """Delete the resources left behind by the runs which crashed.
+
+    The resources which can't be deleted are adopted by the journal
+    of the current process, to be tried again by the next sweep.
+    The journals which can't be read are skipped, so that a sweep
+    never fails.
+    """
+    journal = get_journal(directory)
+    for path in glob.glob(os.path.join(directory, "*.json")):
+        try:
+            pid = int(os.path.splitext(os.path.basename(path))[0])
+        except ValueError:
+            continue
+        if pid == os.getpid() or _is_running(pid):
+            continue
+
+        try:
+            with open(path) as stream:
+                owners = json.load(stream)
+            items = list(owners.items())
+        except (IOError, ValueError, AttributeError) as exc:
+            LOG.warning("Skipping the unreadable journal %s: %s", path, exc)
+            continue
+        LOG.info("Sweeping the resources of %d backend(s) left by %s.",
+                 len(owners), path)
+        failed = {}
+        for owner, entry in items:
+            try:
+                backend_type = _import_backend(entry["backend"])
+                backend_type.reap(entry["resources"])
+            except NotImplementedError as exc:
+                # Retrying won't help.
+                LOG.warning("Forgetting the resources of %s: %s",
+                            owner, exc)
+            except Exception:  # pylint: disable=broad-except
+                LOG.exception("Sweeping the resources of %s failed.", owner)
+                failed[owner] = entry
+        if failed:
+            journal.adopt(failed)
+        try:
+            os.remove(path)
+        except OSError as exc:
+            LOG.warning("Could not remove the journal %s: %s", path, exc)
+
+
+class Reaper(object):
+    """Run cleanups in the background, retrying the failed ones.
+
+    The cleanups have to be resumable, since a failed cleanup is
+    called again, up to *retry_count* times.
+    """
+
+    def __init__(self, workers=REAPER_WORKERS,
+                 retry_count=REAPER_RETRY_COUNT,
+                 retry_delay=REAPER_RETRY_DELAY):
+        self._retry_count = retry_count
+        self._retry_delay = retry_delay
+        self._queue = six.moves.queue.Queue()
+        for _ in range(workers):
+            worker = threading.Thread(target=self._work)
+            worker.daemon = True
+            worker.start()
+
+    def _work(self):
+        while True:
+            cleanup = self._queue.get()
+            try:
+                self._run(cleanup)
+            finally:
+                self._queue.task_done()
+
+    def _run(self, cleanup):
+        for attempt in range(1, self._retry_count + 1):
+            try:
+                cleanup()
+                return
+            except Exception:  # pylint: disable=broad-except
+                LOG.exception("Cleanup attempt %d of %d failed.",
+                              attempt, self._retry_count)
+                if attempt < self._retry_count:
+                    time.sleep(self._retry_delay)
+        LOG.error("Giving up on the cleanup, the remaining resources "
+                  "are left for the next sweep.")
+
+    def submit(self, cleanup):
+        """Call *cleanup* in the background."""
+        self._queue.put(cleanup)
+
+    def wait(self):
+        """Wait for all the submitted cleanups to finish."""
+        self._queue.join()
+
+
+@util.run_once
+def get_reaper():
+    """Get the reaper used by the scenarios.
+
+    It is created only once, argus waiting for its cleanups
+    to finish before exiting.
+    """
+    reaper = Reaper()
+    atexit.register(reaper.wait)
+    return reaper
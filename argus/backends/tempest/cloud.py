@@ -181,6 +181,9 @@ class RescueWindowsBackend(tempest_backend.BaseWindowsTempestBackend):
     def rescue_server(self):
         """Rescue the underlying instance."""
         admin_pass = self._conf.openstack.image_password
+        # The shells don't survive the rescue, so release them now.
+        self.close_remote_clients()
+        self.clear_facts()
         self._manager.servers_client.rescue_server(
             self.internal_instance_id(),
             adminPass=admin_pass)
@@ -191,6 +194,8 @@ class RescueWindowsBackend(tempest_backend.BaseWindowsTempestBackend):
 
     def unrescue_server(self):
         """Unrescue the underlying instance."""
+        self.close_remote_clients()
+        self.clear_facts()
         self._manager.servers_client.unrescue_server(
             self.internal_instance_id())
         waiters.wait_for_server_status(
@@ -0,0 +1,109 @@
+# Copyright 2016 Cloudbase Solutions Srl
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Cache the prepared instances as snapshots, for booting the next ones."""
+
+import datetime
+
+from argus import util
+
+with util.restore_excepthook():
+    from tempest.common import waiters
+
+
+LOG = util.get_logger()
+
+# The metadata key of the snapshots, holding their cache key.
+CACHE_KEY = "argus_cache_key"
+DATE_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+
+class ImageCache(object):
+    """Snapshots of prepared instances, indexed by a cache key.
+
+    The snapshots are regular images, which have the cache key in
+    their metadata, so they can be found by the next runs of argus.
+    They are evicted when they are older than *max_age* hours or when
+    there are more than *max_count* of them, the oldest ones first.
+
+    :param manager: The :class:`APIManager` used for the images.
+    """
+
+    def __init__(self, manager, max_age, max_count):
+        self._manager = manager
+        self._max_age = datetime.timedelta(hours=max_age)
+        self._max_count = max_count
+
+    def _images(self):
+        """Get the cached images, the newest ones first."""
+        images = self._manager.images_client.list_images(
+            detail=True)['images']
+        images = [image for image in images
+                  if CACHE_KEY in (image.get('metadata') or {})]
+        return sorted(images, key=lambda image: image['created'],
+                      reverse=True)
+
+    def _expired(self, image, now):
+        created = datetime.datetime.strptime(image['created'], DATE_FORMAT)
+        return now - created > self._max_age
+
+    def lookup(self, key):
+        """Get the ID of the newest usable image cached for *key*."""
+        now = datetime.datetime.utcnow()
+        for image in self._images():
+            if (image['metadata'][CACHE_KEY] == key and
+                    image['status'] == 'ACTIVE' and
+                    not self._expired(image, now)):
+                LOG.info("Found the cached image %s for %s.",
+                         image['id'], key)
+                return image['id']
+        LOG.info("There is no cached image for %s.", key)
+        return None
+
+    def store(self, server_id, key):
+        """Snapshot the given server, caching it under *key*.
+
+        :returns: The ID of the new image.
+        """
+        name = util.rand_name("argus-cache")
+        LOG.info("Caching the image of %s as %s...", server_id, name)
+        self._manager.images_client.create_image(
+            server_id, name=name, metadata={CACHE_KEY: key})
+        images = self._manager.images_client.list_images(
+            detail=True, name=name)['images']
+        image_id = images[0]['id']
+        waiters.wait_for_image_status(self._manager.images_client,
+                                      image_id, 'ACTIVE')
+        return image_id
+
+    def evict(self):
+        """Delete the cached images which are too old or too many."""
+        now = datetime.datetime.utcnow()
+        kept = 0
+        for image in self._images():
+            if image['status'] == 'SAVING':
+                # Still being saved, possibly by another run.
+                continue
+            if (image['status'] == 'ACTIVE' and kept < self._max_count and
+                    not self._expired(image, now)):
+                kept += 1
+                continue
+
+            LOG.info("Evicting the cached image %s.", image['id'])
+            try:
+                self._manager.images_client.delete_image(image['id'])
+            except Exception as exc:  # pylint: disable=broad-except
+                LOG.warning("Could not delete the cached image %s: %s",
+                            image['id'], exc)
@@ -13,21 +13,32 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import base64
 import contextlib
+import functools
 import os
 import tempfile
 
+from argus import exceptions
 from argus import util
 
 with util.restore_excepthook():
     from tempest import clients
     from tempest.common import credentials
+    from tempest.common import dynamic_creds
     from tempest.common import waiters
+    try:
+        from tempest.lib import exceptions as lib_exc
+    except ImportError:
+        from tempest_lib import exceptions as lib_exc
 
 
 OUTPUT_STATUS_OK = 200
 OUTPUT_SIZE = 128
 OUTPUT_EPSILON = int(OUTPUT_SIZE / 10)
+# The number of lines which are looked for in the console output,
+# for finding where the lines which weren't read yet start.
+OUTPUT_ANCHOR_SIZE = OUTPUT_EPSILON
 LOG = util.get_logger()
 
 
@@ -42,12 +53,231 @@ def _create_tempfile(content):
         os.remove(path)
 
 
-class APIManager(object):
-    """Manager which uses tempest modules for interacting with the OpenStack API."""
+def _split_lines(content):
+    # Split the lines the way nova counts them, keeping their ends.
+    lines = [line + "\n" for line in content.split("\n")]
+    lines[-1] = lines[-1][:-1]
+    if not lines[-1]:
+        lines.pop()
+    return lines
+
+
+class ConsoleLog(object):
+    """The console output of an instance, read incrementally.
+
+    Nova returns only the last lines of the console output, so the
+    lines which were read already are kept in a local file and only
+    the ones which follow them are appended. These are found after the
+    last lines which were read, a larger tail being fetched when they
+    aren't in it. The whole output is fetched again when they can't be
+    found at all, for instance when the console log was replaced, or
+    when they are found more than once.
+
+    :param get_output:
+        A function which returns the given number of lines from
+        the end of the console output.
+    """
+
+    def __init__(self, get_output):
+        self._get_output = get_output
+        self._file = tempfile.TemporaryFile()
+        # The last complete lines which were read.
+        self._anchor = []
+        # The last line, which can still be continued.
+        self._pending = ""
+
+    def _read_lines(self):
+        self._file.seek(0)
+        return _split_lines(self._file.read().decode("utf-8"))
+
+    def _find_anchor(self, lines):
+        """Find where the lines which weren't read yet start.
+
+        All the given lines before them have to be the last lines
+        which were read. If this holds for more than one position,
+        as when the new lines repeat the last ones, the position
+        can't be told and None is returned, like when there is none.
+        """
+        if len(self._anchor) < OUTPUT_ANCHOR_SIZE:
+            # Too few lines to be found reliably.
+            return None
+        size = len(self._anchor)
+        read_lines = None
+        found = []
+        for end in range(size, len(lines) + 1):
+            if lines[end - size:end] != self._anchor:
+                continue
+            if read_lines is None:
+                read_lines = self._read_lines()
+            if end <= len(read_lines) and lines[:end] == read_lines[-end:]:
+                found.append(end)
+        return found[0] if len(found) == 1 else None
+
+    def _fetch(self, limit):
+        """Fetch the lines which weren't read yet.
+
+        :returns:
+            A tuple of the new lines and a flag telling if they
+            are the whole console output.
+        """
+        while True:
+            lines = _split_lines(self._get_output(limit))
+            end = self._find_anchor(lines)
+            if end is not None:
+                return lines[end:], False
+            if len(lines) < (limit - OUTPUT_EPSILON):
+                return lines, True
+            limit *= 2
+
+    def read(self, limit):
+        """Get the whole console output, fetching only what is new.
+
+        :param limit:
+            Number of lines to fetch at first from the end of the
+            console log, more being fetched if they're not enough.
+        """
+        lines, whole = self._fetch(limit)
+        if whole:
+            self._file.seek(0)
+            self._file.truncate()
+            self._anchor = []
+        self._pending = ""
+        if lines and not lines[-1].endswith("\n"):
+            self._pending = lines.pop()
+
+        self._file.seek(0, os.SEEK_END)
+        self._file.write("".join(lines).encode("utf-8"))
+        self._anchor = (self._anchor + lines)[-OUTPUT_ANCHOR_SIZE:]
+        return "".join(self._read_lines()) + self._pending
 
-    def __init__(self):
-        self.isolated_creds = credentials.get_credentials_provider(
+
+def _describe(resource):
+    if not resource:
+        return None
+    return {"id": resource["id"], "name": resource["name"]}
+
+
+class _RecordedCredentials(object):
+    """Dynamic credentials, rebuilt from their record."""
+
+    def __init__(self, record):
+        self.__dict__.update(record)
+
+
+class _ReaperCredentialProvider(object):
+    """Credentials for deleting the resources of recorded credentials.
+
+    A temporary user is created in the tenant of the recorded dynamic
+    credentials, with the admin role, being deleted by
+    :meth:`clear_creds`. The recorded credentials are deleted by
+    :meth:`clear_recorded_creds`, together with their tenant and their
+    network resources.
+
+    :raises:
+        `tempest.lib.exceptions.NotFound` if the tenant
+        doesn't exist anymore.
+    """
+
+    def __init__(self, record):
+        self._record = record
+        self._provider = credentials.get_credentials_provider(
             self.__class__.__name__, network_resources={})
+        if not isinstance(self._provider,
+                          dynamic_creds.DynamicCredentialProvider):
+            raise exceptions.ArgusError(
+                "The resources of the tenant {} can be deleted only with "
+                "dynamic credentials.".format(record["tenant_id"]))
+
+        creds_client = self._provider.creds_client
+        project = {"id": record["tenant_id"], "name": record["tenant_name"]}
+        username = util.rand_name("argus-reaper")
+        password = base64.urlsafe_b64encode(os.urandom(18)).decode()
+        self._user = creds_client.create_user(
+            username, password, project, username + "@example.com")
+        try:
+            creds_client.assign_user_role(self._user, project,
+                                          self._provider.admin_role)
+            self._credentials = creds_client.get_credentials(
+                self._user, project, password)
+        except Exception:
+            self.clear_creds()
+            raise
+
+    def get_primary_creds(self):
+        return self._credentials
+
+    def clear_recorded_creds(self):
+        # tempest deletes only the credentials it knows about.
+        # pylint: disable=protected-access
+        self._provider._creds["recorded"] = _RecordedCredentials(
+            self._record)
+        self._provider.clear_creds()
+
+    def clear_creds(self):
+        self._provider.creds_client.delete_user(self._user["id"])
+
+
+@contextlib.contextmanager
+def reaper_manager(record):
+    """Get a manager for deleting the resources of the given credentials.
+
+    The resources of dynamic credentials are deleted through a
+    temporary user with the admin role in their tenant. If this
+    succeeds, the credentials are deleted as well, with their tenant.
+    The resources of the other credentials can be deleted only
+    with the same credentials.
+
+    :param record:
+        The credentials, as returned by
+        :meth:`APIManager.credentials_record`.
+    :raises:
+        `ArgusError` if the resources can't be deleted now.
+    :returns:
+        An :class:`APIManager` or None, if the tenant doesn't exist
+        anymore, and neither do its resources.
+    """
+    if not record.get("dynamic"):
+        manager = APIManager()
+        try:
+            tenant_id = manager.primary_credentials().tenant_id
+            if tenant_id != record["tenant_id"]:
+                raise exceptions.ArgusError(
+                    "The resources of the tenant {} can't be deleted with "
+                    "the credentials of {}.".format(record["tenant_id"],
+                                                    tenant_id))
+            yield manager
+        finally:
+            manager.cleanup_credentials()
+        return
+
+    try:
+        provider = _ReaperCredentialProvider(record)
+    except lib_exc.NotFound:
+        # The tenant is deleted last, after its resources.
+        LOG.info("The tenant %s was already deleted.", record["tenant_id"])
+        yield None
+        return
+
+    manager = APIManager(provider)
+    try:
+        yield manager
+        provider.clear_recorded_creds()
+    finally:
+        manager.cleanup_credentials()
+
+
+class APIManager(object):
+    """Manager which uses tempest modules for interacting with the OpenStack API.
+
+    :param isolated_creds:
+        The credential provider whose primary credentials are used,
+        instead of the one configured for tempest.
+    """
+
+    def __init__(self, isolated_creds=None):
+        self.isolated_creds = (
+            isolated_creds or credentials.get_credentials_provider(
+                self.__class__.__name__, network_resources={}))
         primary_credentials = self.primary_credentials()
         self._manager = clients.Manager(credentials=primary_credentials)
 
@@ -81,6 +311,9 @@ class APIManager(object):
         # Heat client
         self.orchestration_client = self._manager.orchestration_client
 
+        # The console logs of the instances, by their ids.
+        self._console_logs = {}
+
     def cleanup_credentials(self):
         """Cleanup any credentials created during the initialization."""
         self.isolated_creds.clear_creds()
@@ -89,6 +322,31 @@ class APIManager(object):
         """Get the underlying :class:`tempest.common.isolated_creds.IsolatedCreds`."""
         return self.isolated_creds.get_primary_creds()
 
+    def has_dynamic_credentials(self):
+        """Check if the credentials are created only for this manager.
+
+        Their tenant is deleted by :meth:`cleanup_credentials`.
+        """
+        return isinstance(self.isolated_creds,
+                          dynamic_creds.DynamicCredentialProvider)
+
+    def credentials_record(self):
+        """Describe the primary credentials, for :func:`reaper_manager`.
+
+        The record can be serialized as JSON.
+        """
+        creds = self.primary_credentials()
+        record = {"tenant_id": creds.tenant_id, "dynamic": False}
+        if self.has_dynamic_credentials():
+            record.update(dynamic=True,
+                          tenant_name=creds.tenant_name,
+                          user_id=creds.user_id,
+                          username=creds.username,
+                          network=_describe(creds.network),
+                          subnet=_describe(creds.subnet),
+                          router=_describe(creds.router))
+        return record
+
     def create_keypair(self, name):
         """Create a new keypair with the given name
 
@@ -141,15 +399,16 @@ class APIManager(object):
             be retrieved.
         :param limit:
             Number of lines to fetch from the end of console log.
+
+        The output is read incrementally, through a :class:`ConsoleLog`,
+        only the lines added since the previous call being fetched.
         """
-        content = None
-        while True:
-            content = self._instance_output(instance_id, limit)
-            if len(content.splitlines()) >= (limit - OUTPUT_EPSILON):
-                limit *= 2
-            else:
-                break
-        return content
+        console_log = self._console_logs.get(instance_id)
+        if console_log is None:
+            console_log = ConsoleLog(
+                functools.partial(self._instance_output, instance_id))
+            self._console_logs[instance_id] = console_log
+        return console_log.read(limit)
 
     def instance_server(self, instance_id):
         """Get more details about the given instance id."""
@@ -0,0 +1,237 @@
+# Copyright 2016 Cloudbase Solutions Srl
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Boot instances in advance, for the scenarios which will need them."""
+
+import atexit
+import collections
+import hashlib
+import json
+import threading
+
+from argus.backends.tempest import manager as api_manager
+from argus import util
+
+with util.restore_excepthook():
+    from tempest.common import waiters
+
+
+LOG = util.get_logger()
+
+InstanceSpec = collections.namedtuple(
+    "InstanceSpec",
+    "image_ref flavor_ref availability_zone userdata metadata")
+"""What an instance is booted with."""
+
+Lease = collections.namedtuple("Lease", "manager keypair server")
+"""A booted instance, along with the resources it was created with.
+
+*manager* is the :class:`APIManager` whose credentials own the
+instance and *keypair* is the keypair the instance was booted with.
+"""
+
+
+def _get_key(spec):
+    # The userdata and the metadata can't be changed after the
+    # instance is created, so they are part of the key as well.
+    userdata = hashlib.sha256(spec.userdata or b"").hexdigest()
+    metadata = json.dumps(spec.metadata, sort_keys=True)
+    return (spec.image_ref, spec.flavor_ref, spec.availability_zone,
+            userdata, metadata)
+
+
+def _destroy(lease):
+    manager, keypair, server = lease
+    try:
+        if server:
+            manager.servers_client.delete_server(server["id"])
+            waiters.wait_for_server_termination(manager.servers_client,
+                                                server["id"])
+        if keypair:
+            keypair.destroy()
+    finally:
+        manager.cleanup_credentials()
+
+
+class InstancePool(object):
+    """Instances booted in the background, ready to be leased.
+
+    The pool keeps up to *size* instances booted for each
+    :class:`InstanceSpec` which is asked for more than once, since
+    the instances booted for a spec used by a single scenario would
+    be wasted. The second lease of a spec starts the booting and
+    returns nothing, like the first one, while the next ones get an
+    instance which is already active, if one is ready. Every lease
+    starts booting another instance, which replaces it. The
+    instances which weren't leased are destroyed by :meth:`close`.
+
+    :param journal:
+        An optional :class:`argus.backends.reaper.Journal`, where the
+        resources of the instances are recorded until they are leased
+        or destroyed, so that a crashed run doesn't leak them.
+    :param backend_type:
+        The dotted path of the backend class which can delete the
+        resources recorded in the *journal*.
+    """
+
+    def __init__(self, size, dns_nameservers=None, journal=None,
+                 backend_type=None):
+        self._size = size
+        self._dns_nameservers = dns_nameservers
+        self._journal = journal
+        self._backend_type = backend_type
+        self._ready = collections.defaultdict(list)
+        self._booting = collections.Counter()
+        self._leases = collections.Counter()
+        self._owners = {}
+        self._threads = []
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def _record(self, owner, kind, resource_id):
+        if self._journal is not None:
+            self._journal.record(owner, self._backend_type,
+                                 kind, resource_id)
+
+    def _forget(self, owner):
+        if self._journal is not None:
+            self._journal.forget(owner)
+
+    def _destroy(self, owner, lease):
+        _destroy(lease)
+        self._forget(owner)
+
+    def _boot(self, key, spec):
+        lease = None
+        owner = util.rand_name("argus-pool")
+        try:
+            manager = api_manager.APIManager()
+            lease = Lease(manager, None, None)
+            self._record(owner, "credentials", manager.credentials_record())
+            subnet_id = manager.primary_credentials().subnet["id"]
+            manager.subnets_client.update_subnet(
+                subnet_id, dns_nameservers=self._dns_nameservers)
+            keypair = manager.create_keypair(name=self.__class__.__name__)
+            lease = lease._replace(keypair=keypair)
+            self._record(owner, "keypair", keypair.name)
+
+            kwargs = {"user_data": spec.userdata,
+                      "metadata": spec.metadata,
+                      "availability_zone": spec.availability_zone}
+            server = manager.servers_client.create_server(
+                name=util.rand_name("argus-pool") + "-instance",
+                imageRef=spec.image_ref,
+                flavorRef=spec.flavor_ref,
+                key_name=keypair.name,
+                disk_config="AUTO",
+                **{name: value for name, value in kwargs.items() if value}
+            )["server"]
+            lease = lease._replace(server=server)
+            self._record(owner, "server", server["id"])
+            waiters.wait_for_server_status(manager.servers_client,
+                                           server["id"], "ACTIVE")
+        except Exception:  # pylint: disable=broad-except
+            LOG.exception("Booting an instance for the pool failed.")
+            with self._lock:
+                self._booting[key] -= 1
+            if lease:
+                try:
+                    self._destroy(owner, lease)
+                except Exception:  # pylint: disable=broad-except
+                    LOG.exception("Cleaning up the failed instance failed.")
+            return
+
+        with self._lock:
+            self._booting[key] -= 1
+            closed = self._closed
+            if not closed:
+                self._ready[key].append(lease)
+                self._owners[server["id"]] = owner
+        if closed:
+            self._destroy(owner, lease)
+        else:
+            LOG.info("The instance %s is ready in the pool.", server["id"])
+
+    def _fill(self, key, spec):
+        # Called with the lock held.
+        missing = self._size - len(self._ready[key]) - self._booting[key]
+        for _ in range(max(0, missing)):
+            self._booting[key] += 1
+            thread = threading.Thread(target=self._boot, args=(key, spec))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def lease(self, spec):
+        """Take an active instance booted with the given spec.
+
+        :returns: A :class:`Lease` or None, if there is no instance ready.
+        """
+        key = _get_key(spec)
+        with self._lock:
+            if self._closed:
+                return None
+            ready = self._ready[key]
+            lease = ready.pop(0) if ready else None
+            self._leases[key] += 1
+            if self._leases[key] > 1:
+                self._fill(key, spec)
+        if lease:
+            LOG.info("Leasing the instance %s from the pool.",
+                     lease.server["id"])
+        return lease
+
+    def forget(self, lease):
+        """Forget a leased instance, once its new owner recorded it.
+
+        Until then, the instance is still kept in the journal
+        of the pool.
+        """
+        with self._lock:
+            owner = self._owners.pop(lease.server["id"], None)
+        if owner is not None:
+            self._forget(owner)
+
+    def close(self):
+        """Destroy the instances which weren't leased."""
+        with self._lock:
+            self._closed = True
+            leases = [(self._owners.pop(lease.server["id"]), lease)
+                      for ready in self._ready.values()
+                      for lease in ready]
+            self._ready.clear()
+            threads, self._threads = self._threads, []
+
+        for owner, lease in leases:
+            LOG.info("Destroying the pooled instance %s.",
+                     lease.server["id"])
+            try:
+                self._destroy(owner, lease)
+            except Exception:  # pylint: disable=broad-except
+                LOG.exception("Destroying the pooled instance failed.")
+        # The instances still booting are destroyed when they are ready.
+        for thread in threads:
+            thread.join()
+
+
+@util.run_once
+def get_pool(size, dns_nameservers=None, journal=None, backend_type=None):
+    """Get the instance pool used by the backends.
+
+    It is created only once, being closed when argus exits.
+    """
+    pool = InstancePool(size, dns_nameservers, journal, backend_type)
+    atexit.register(pool.close)
+    return pool
@@ -16,22 +16,82 @@
 
 import abc
 import base64
+import hashlib
+import json
+import sys
+import threading
 
 import six
 
 from argus.backends import base as base_backend
+from argus.backends import pipeline
 from argus.backends import windows
+from argus.backends.tempest import image_cache
 from argus.backends.tempest import manager as api_manager
+from argus.backends.tempest import pool
 from argus import util
 
 with util.restore_excepthook():
     from tempest.common import waiters
+    try:
+        from tempest.lib import exceptions as lib_exc
+    except ImportError:
+        from tempest_lib import exceptions as lib_exc
 
 
 LOG = util.get_logger()
 
 # Starting size as number of lines and tolerance.
 OUTPUT_SIZE = 128
+# The delay between the attempts of associating the floating IP,
+# while the instance isn't active yet.
+FLOATING_IP_DELAY = 2
+# The rules of the security groups created for the instances.
+SECURITY_GROUP_RULES = (
+    {
+        # http RDP
+        'ip_protocol': 'tcp',
+        'from_port': 3389,
+        'to_port': 3389,
+        'cidr': '0.0.0.0/0',
+    },
+    {
+        # http winrm
+        'ip_protocol': 'tcp',
+        'from_port': 5985,
+        'to_port': 5985,
+        'cidr': '0.0.0.0/0',
+    },
+    {
+        # https winrm
+        'ip_protocol': 'tcp',
+        'from_port': 5986,
+        'to_port': 5986,
+        'cidr': '0.0.0.0/0',
+    },
+    {
+        # ssh
+        'ip_protocol': 'tcp',
+        'from_port': 22,
+        'to_port': 22,
+        'cidr': '0.0.0.0/0',
+    },
+    {
+        # ping
+        'ip_protocol': 'icmp',
+        'from_port': -1,
+        'to_port': -1,
+        'cidr': '0.0.0.0/0',
+    },
+)
+
+# The order in which the resources of a crashed run are deleted.
+REAP_ORDER = ("security_group_rule", "server", "floating_ip",
+              "security_group", "keypair")
+
+# The security groups shared by the instances, by tenant and name.
+_SHARED_SECURITY_GROUPS = {}
+_SHARED_SECURITY_GROUPS_LOCK = threading.Lock()
 
 
 # pylint: disable=abstract-method; FP: https://bitbucket.org/logilab/pylint/issues/565
@@ -69,12 +129,44 @@ class BaseTempestBackend(base_backend.CloudBackend):
         self._routers = []
         self._floating_ip = None
         self._networks = None    # list with UUIDs for future attached NICs
+        self._image_cache_key = None
+        self._cached_image = None
+        self._server_active = threading.Event()
+        # The time taken by each step of setup_instance.
+        self.setup_timings = None
 
         # set some members from the configuration file needed by recipes
         self.image_ref = self._conf.openstack.image_ref
         self.flavor_ref = self._conf.openstack.flavor_ref
         self._manager = api_manager.APIManager()
 
+    @property
+    def _image_cache(self):
+        # Not cached, since the manager changes when an instance is leased.
+        return image_cache.ImageCache(
+            self._manager, self._conf.openstack.image_cache_max_age,
+            self._conf.openstack.image_cache_max_count)
+
+    def use_image_cache(self, key):
+        if not self._conf.openstack.image_cache:
+            return False
+
+        self._image_cache_key = key
+        self._cached_image = self._image_cache.lookup(key)
+        if self._cached_image:
+            self.image_ref = self._cached_image
+        return self.from_image_cache()
+
+    def from_image_cache(self):
+        return self._cached_image is not None
+
+    def save_image_cache(self):
+        if self._image_cache_key is None or self.from_image_cache():
+            return
+        self._image_cache.store(self.internal_instance_id(),
+                                self._image_cache_key)
+        self._image_cache.evict()
+
     def _configure_networking(self):
         subnet_id = self._manager.primary_credentials().subnet["id"]
         self._manager.subnets_client.update_subnet(
@@ -90,75 +182,137 @@ class BaseTempestBackend(base_backend.CloudBackend):
             imageRef=self.image_ref,
             flavorRef=self.flavor_ref,
             **kwargs)
-        waiters.wait_for_server_status(
-            self._manager.servers_client, server['server']['id'], wait_until)
+        if wait_until:
+            waiters.wait_for_server_status(
+                self._manager.servers_client, server['server']['id'],
+                wait_until)
         return server['server']
 
-    def _assign_floating_ip(self):
+    def _create_floating_ip(self):
         floating_ip = self._manager.floating_ips_client.create_floating_ip()
         floating_ip = floating_ip['floating_ip']
-
-        self._manager.floating_ips_client.associate_floating_ip_to_server(
-            floating_ip['ip'], self.internal_instance_id())
+        self._journal("floating_ip", floating_ip['id'])
         return floating_ip
 
-    def _add_security_group_exceptions(self, secgroup_id):
+    def _associate_floating_ip(self):
+        # The association fails until the instance gets its fixed IP,
+        # which usually happens before the instance becomes active.
+        client = self._manager.floating_ips_client
+        while True:
+            try:
+                client.associate_floating_ip_to_server(
+                    self._floating_ip['ip'], self.internal_instance_id())
+                return
+            except Exception as exc:  # pylint: disable=broad-except
+                if self._server_active.is_set():
+                    raise
+                LOG.debug("The floating IP can't be associated yet: %s",
+                          exc)
+                self._server_active.wait(FLOATING_IP_DELAY)
+
+    def _add_security_group_exceptions(self, secgroup_id,
+                                       rules=SECURITY_GROUP_RULES):
         _client = self._manager.security_group_rules_client
-        rulesets = [
-            {
-                # http RDP
-                'ip_protocol': 'tcp',
-                'from_port': 3389,
-                'to_port': 3389,
-                'cidr': '0.0.0.0/0',
-            },
-            {
-                # http winrm
-                'ip_protocol': 'tcp',
-                'from_port': 5985,
-                'to_port': 5985,
-                'cidr': '0.0.0.0/0',
-            },
-            {
-                # https winrm
-                'ip_protocol': 'tcp',
-                'from_port': 5986,
-                'to_port': 5986,
-                'cidr': '0.0.0.0/0',
-            },
-            {
-                # ssh
-                'ip_protocol': 'tcp',
-                'from_port': 22,
-                'to_port': 22,
-                'cidr': '0.0.0.0/0',
-            },
-            {
-                # ping
-                'ip_protocol': 'icmp',
-                'from_port': -1,
-                'to_port': -1,
-                'cidr': '0.0.0.0/0',
-            },
-        ]
-        for ruleset in rulesets:
+        for ruleset in rules:
             sg_rule = _client.create_security_group_rule(
                 parent_group_id=secgroup_id, **ruleset)['security_group_rule']
             yield sg_rule
 
+    def _create_shared_security_group(self, sg_name):
+        LOG.info("Creating the shared security group %s.", sg_name)
+        client = self._manager.security_groups_client
+        secgroup = client.create_security_group(
+            name=sg_name,
+            description="argus shared security group")['security_group']
+        try:
+            # The rules stay with the group.
+            list(self._add_security_group_exceptions(secgroup['id']))
+        except Exception:
+            # Don't leave behind a group which would be reused
+            # without all of its rules.
+            exc_info = sys.exc_info()
+            try:
+                client.delete_security_group(secgroup['id'])
+            except Exception as exc:  # pylint: disable=broad-except
+                LOG.warning("Could not delete the incomplete security "
+                            "group %s: %s", sg_name, exc)
+            six.reraise(*exc_info)
+        return secgroup
+
+    def _repair_shared_security_group(self, secgroup):
+        """Add the rules which are missing from a shared security group.
+
+        The group can be left without some of them by a run which
+        crashed while creating it.
+        """
+        existing = set(
+            (rule['ip_protocol'], rule['from_port'], rule['to_port'],
+             (rule.get('ip_range') or {}).get('cidr'))
+            for rule in secgroup.get('rules') or ())
+        missing = [rule for rule in SECURITY_GROUP_RULES
+                   if (rule['ip_protocol'], rule['from_port'],
+                       rule['to_port'], rule['cidr']) not in existing]
+        if missing:
+            LOG.warning("Adding %d missing rules to the shared security "
+                        "group %s.", len(missing), secgroup['name'])
+            list(self._add_security_group_exceptions(secgroup['id'],
+                                                     missing))
+
+    def _get_shared_security_group(self):
+        """Get the security group shared by the instances of the tenant.
+
+        The group is identified by the hash of its rules, so it is
+        created only once for a given set of rules, the next
+        instances reusing it, even between runs.
+        """
+        rules = json.dumps(SECURITY_GROUP_RULES, sort_keys=True)
+        sg_name = "argus-" + hashlib.sha256(rules.encode()).hexdigest()[:16]
+        tenant_id = self._manager.primary_credentials().tenant_id
+        client = self._manager.security_groups_client
+
+        with _SHARED_SECURITY_GROUPS_LOCK:
+            key = (tenant_id, sg_name)
+            if key not in _SHARED_SECURITY_GROUPS:
+                groups = client.list_security_groups()['security_groups']
+                found = [group for group in groups
+                         if group['name'] == sg_name]
+                if found:
+                    secgroup = found[0]
+                    self._repair_shared_security_group(secgroup)
+                else:
+                    secgroup = self._create_shared_security_group(sg_name)
+                _SHARED_SECURITY_GROUPS[key] = secgroup
+            return _SHARED_SECURITY_GROUPS[key]
+
+    def _shares_security_group(self):
+        """Check if the instance uses the shared security group.
+
+        The dynamic credentials have a tenant of their own, which
+        no one else uses and whose groups are deleted with it.
+        """
+        return (self._conf.openstack.shared_security_group and
+                not self._manager.has_dynamic_credentials())
+
     def _create_security_groups(self):
+        if self._shares_security_group():
+            return self._get_shared_security_group()
+
         sg_name = util.rand_name(self.__class__.__name__)
         sg_desc = sg_name + " description"
         secgroup = self._manager.security_groups_client.create_security_group(
             name=sg_name, description=sg_desc)['security_group']
+        self._journal("security_group", secgroup['id'])
 
         # Add rules to the security group.
         for rule in self._add_security_group_exceptions(secgroup['id']):
             self._security_groups_rules.append(rule['id'])
+            self._journal("security_group_rule", rule['id'])
+        return secgroup
+
+    def _add_security_group(self):
         self._manager.servers_client.add_security_group(
             self.internal_instance_id(),
-            secgroup['name'])
-        return secgroup
+            self._security_group['name'])
 
     def cleanup(self):
         """Cleanup the underlying instance.
@@ -170,11 +324,15 @@ class BaseTempestBackend(base_backend.CloudBackend):
 
         LOG.info("Cleaning up...")
 
-        if self._security_groups_rules:
-            for rule in self._security_groups_rules:
-                self._manager.security_group_rules_client.delete_security_group_rule(rule)
+        # Every resource is forgotten once it is deleted, so that
+        # the cleanup can be resumed if it fails midway.
+        rules_client = self._manager.security_group_rules_client
+        while self._security_groups_rules:
+            rules_client.delete_security_group_rule(
+                self._security_groups_rules[0])
+            self._security_groups_rules.pop(0)
 
-        if self._security_group:
+        if self._security_group and self._server:
             self._manager.servers_client.remove_security_group(
                 self.internal_instance_id(),
                 self._security_group['name'])
@@ -185,33 +343,159 @@ class BaseTempestBackend(base_backend.CloudBackend):
             waiters.wait_for_server_termination(
                 self._manager.servers_client,
                 self.internal_instance_id())
+            self._server = None
+
+        if self._security_group:
+            if not self._shares_security_group():
+                self._manager.security_groups_client.delete_security_group(
+                    self._security_group['id'])
+            self._security_group = None
 
         if self._floating_ip:
             self._manager.floating_ips_client.delete_floating_ip(
                 self._floating_ip['id'])
+            self._floating_ip = None
 
         if self._keypair:
             self._keypair.destroy()
+            self._keypair = None
 
         self._manager.cleanup_credentials()
 
+    @classmethod
+    def reap(cls, resources):
+        records = [resource_id for kind, resource_id in resources
+                   if kind == "credentials"]
+        if not records:
+            # They are recorded before anything is created with them.
+            return
+        with api_manager.reaper_manager(records[0]) as manager:
+            if manager is None:
+                return
+            rules_client = manager.security_group_rules_client
+            groups_client = manager.security_groups_client
+            deleters = {
+                "security_group_rule": rules_client.delete_security_group_rule,
+                "server": manager.servers_client.delete_server,
+                "floating_ip": manager.floating_ips_client.delete_floating_ip,
+                "security_group": groups_client.delete_security_group,
+                "keypair": manager.keypairs_client.delete_keypair,
+            }
+            for kind in REAP_ORDER:
+                for resource_kind, resource_id in resources:
+                    if resource_kind != kind:
+                        continue
+                    if kind == "keypair" and records[0]["dynamic"]:
+                        # It belongs to the user, which is deleted.
+                        continue
+                    LOG.info("Deleting the leaked %s %s.", kind, resource_id)
+                    try:
+                        deleters[kind](resource_id)
+                        if kind == "server":
+                            waiters.wait_for_server_termination(
+                                manager.servers_client, resource_id)
+                    except lib_exc.NotFound:
+                        pass
+
+    def _lease_instance(self):
+        """Take an instance booted in advance by the pool, if possible.
+
+        The backends which attach their own networks to the
+        instance can't use the pooled instances.
+        """
+        pool_size = self._conf.openstack.instance_pool_size
+        if not pool_size or self._networks is not None:
+            return False
+
+        journal = self._get_journal() if self._can_reap() else None
+        instance_pool = pool.get_pool(pool_size,
+                                      self._conf.argus.dns_nameservers,
+                                      journal, self._backend_type())
+        lease = instance_pool.lease(pool.InstanceSpec(
+            self.image_ref, self.flavor_ref, self._availability_zone,
+            self.userdata, self.metadata))
+        if lease is None:
+            return False
+
+        # The instance belongs to the credentials of the pool.
+        self._manager.cleanup_credentials()
+        self._manager, self._keypair, self._server = lease
+        self._journal("credentials", self._manager.credentials_record())
+        self._journal("keypair", self._keypair.name)
+        self._journal("server", self._server["id"])
+        instance_pool.forget(lease)
+        return True
+
+    def _setup_steps(self, steps):
+        """Add the steps which create the instance to the given pipeline.
+
+        The steps which don't depend on each other run concurrently.
+        Subclasses can add their own steps, which require these.
+        """
+
+        def create_keypair():
+            self._keypair = self._manager.create_keypair(
+                name=self.__class__.__name__)
+            self._journal("keypair", self._keypair.name)
+
+        def create_security_group():
+            self._security_group = self._create_security_groups()
+
+        def create_floating_ip():
+            self._floating_ip = self._create_floating_ip()
+
+        def create_server():
+            # The security group is attached from the beginning,
+            # and the instance isn't waited for to become active.
+            self._server = self._create_server(
+                wait_until=None,
+                key_name=self._keypair.name,
+                disk_config='AUTO',
+                user_data=self.userdata,
+                metadata=self.metadata,
+                networks=self._networks,
+                availability_zone=self._availability_zone,
+                security_groups=[{'name': self._security_group['name']}])
+            self._journal("server", self._server["id"])
+
+        def wait_active():
+            try:
+                waiters.wait_for_server_status(
+                    self._manager.servers_client,
+                    self.internal_instance_id(), 'ACTIVE')
+            finally:
+                self._server_active.set()
+
+        steps.add("security_group", create_security_group)
+        steps.add("floating_ip", create_floating_ip)
+        if self._server:
+            # Leased from the pool, already active.
+            self._server_active.set()
+            steps.add("add_security_group", self._add_security_group,
+                      requires=("security_group", ))
+        else:
+            steps.add("networking", self._configure_networking)
+            steps.add("keypair", create_keypair)
+            steps.add("server", create_server,
+                      requires=("networking", "keypair", "security_group"))
+            steps.add("active", wait_active, requires=("server", ))
+        steps.add("associate_floating_ip", self._associate_floating_ip,
+                  requires=("floating_ip", "server")
+                  if "server" in steps else ("floating_ip", ))
+
     def setup_instance(self):
         # pylint: disable=attribute-defined-outside-init
         LOG.info("Creating server...")
 
-        self._configure_networking()
-        self._keypair = self._manager.create_keypair(
-            name=self.__class__.__name__)
-        self._server = self._create_server(
-            wait_until='ACTIVE',
-            key_name=self._keypair.name,
-            disk_config='AUTO',
-            user_data=self.userdata,
-            metadata=self.metadata,
-            networks=self._networks,
-            availability_zone=self._availability_zone)
-        self._floating_ip = self._assign_floating_ip()
-        self._security_group = self._create_security_groups()
+        if not self._lease_instance():
+            self._journal("credentials",
+                          self._manager.credentials_record())
+        steps = pipeline.Pipeline("Creating the instance")
+        self._setup_steps(steps)
+        try:
+            steps.run()
+        finally:
+            self.setup_timings = steps.timings
 
     def reboot_instance(self):
         # Delegate to the manager to reboot the instance
@@ -254,6 +538,17 @@ class BaseWindowsTempestBackend(windows.WindowsBackendMixin,
                                 BaseTempestBackend):
     """Base Tempest backend for testing Windows."""
 
+    def _setup_steps(self, steps):
+        super(BaseWindowsTempestBackend, self)._setup_steps(steps)
+        # The OS of the instance is detected as soon as it is active
+        # and it has a floating IP, while the rest of the steps are
+        # running. The failed connections are retried while it boots.
+        requires = ("associate_floating_ip", )
+        if "active" in steps:
+            requires += ("active", )
+        steps.add("prefetch_remote_client", self.prefetch_remote_client,
+                  requires=requires)
+
     def _get_log_template(self, suffix):
         template = super(BaseWindowsTempestBackend, self)._get_log_template(suffix)
         if self._conf.argus.build and self._conf.argus.arch:
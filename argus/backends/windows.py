@@ -20,6 +20,10 @@ from argus import util
 class WindowsBackendMixin(object):
     """Mixin backend tailored for interacting with Windows."""
 
+    def __init__(self, *args, **kwargs):
+        super(WindowsBackendMixin, self).__init__(*args, **kwargs)
+        self._remote_clients = []
+
     # pylint: disable=unused-argument
     def get_remote_client(self, username=None, password=None,
                           protocol='http', **kwargs):
@@ -29,8 +33,46 @@ class WindowsBackendMixin(object):
             username = self._conf.openstack.image_username
         if password is None:
             password = self._conf.openstack.image_password
-        return windows.WinRemoteClient(self.floating_ip(),
-                                       username, password,
-                                       transport_protocol=protocol)
+        client = windows.WinRemoteClient(
+            self.floating_ip(), username, password,
+            transport_protocol=protocol,
+            persistent_shell=self._conf.winrm.persistent_shell,
+            powershell_host=self._conf.winrm.powershell_host,
+            upload_shells=self._conf.winrm.upload_shells,
+            instance_id=self.internal_instance_id())
+        self._remote_clients.append(client)
+        return client
 
     remote_client = util.cached_property(get_remote_client, 'remote_client')
+
+    def prefetch_remote_client(self):
+        """Start detecting the OS of the instance in the background.
+
+        This can be called as soon as the instance is active and it
+        has a floating IP, letting the detection overlap with the rest
+        of the setup.
+        """
+        self.remote_client.prefetch_manager()
+
+    def close_remote_clients(self):
+        """Close every remote client created by this backend."""
+        for client in self._remote_clients:
+            client.close()
+
+    def clear_facts(self):
+        """Forget the facts known about the instance.
+
+        This should be called when the instance boots again.
+        """
+        for client in self._remote_clients:
+            client.facts.clear()
+
+    def reboot_instance(self):
+        # The shells don't survive a reboot, so release them now.
+        self.close_remote_clients()
+        self.clear_facts()
+        return super(WindowsBackendMixin, self).reboot_instance()
+
+    def cleanup(self):
+        self.close_remote_clients()
+        super(WindowsBackendMixin, self).cleanup()
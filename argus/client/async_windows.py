@@ -0,0 +1,120 @@
+# Copyright 2016 Cloudbase Solutions Srl
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""asyncio frontend for the Windows remote client."""
+
+import functools
+
+try:
+    import asyncio
+except ImportError:
+    try:
+        import trollius as asyncio
+    except ImportError:
+        asyncio = None
+
+from argus import exceptions
+from argus import util
+
+
+class AsyncWinRemoteClient(object):
+    """Run the commands of a :class:`WinRemoteClient` from asyncio.
+
+    Every method returns an asyncio future, which can be awaited
+    by a coroutine, while the command runs in a worker thread of
+    *executor*, the default executor of the loop being used if it
+    isn't given. This lets a single event loop drive many instances
+    at the same time and overlap independent remote work.
+
+    The commands of a client which uses a persistent shell are still
+    executed one at a time, in the order in which they were given.
+    Use several clients for running commands in parallel on the
+    same instance.
+
+    :param client: The :class:`WinRemoteClient` which runs the commands.
+    :param loop: The event loop, the current one by default.
+    :param executor: A :class:`concurrent.futures.Executor`.
+    """
+
+    def __init__(self, client, loop=None, executor=None):
+        if asyncio is None:
+            raise exceptions.ArgusError(
+                "asyncio (or trollius) is needed by AsyncWinRemoteClient.")
+        self._client = client
+        self._loop = loop
+        self._executor = executor
+
+    @property
+    def client(self):
+        """The underlying blocking client."""
+        return self._client
+
+    def _submit(self, method, *args, **kwargs):
+        loop = self._loop or asyncio.get_event_loop()
+        return loop.run_in_executor(
+            self._executor, functools.partial(method, *args, **kwargs))
+
+    def run_command(self, cmd, command_type=util.POWERSHELL):
+        """Run the given command, see :meth:`WinRemoteClient.run_command`."""
+        return self._submit(self._client.run_command, cmd,
+                            command_type=command_type)
+
+    def run_remote_cmd(self, cmd, command_type=util.POWERSHELL):
+        """Run the given command, without logging it."""
+        return self._submit(self._client.run_remote_cmd, cmd,
+                            command_type=command_type)
+
+    def run_command_with_retry(self, cmd, count=util.RETRY_COUNT,
+                               delay=util.RETRY_DELAY,
+                               command_type=util.POWERSHELL, policy=None):
+        """Run the given command until it succeeds."""
+        return self._submit(self._client.run_command_with_retry, cmd,
+                            count=count, delay=delay,
+                            command_type=command_type, policy=policy)
+
+    def run_command_until_condition(self, cmd, cond,
+                                    retry_count=util.RETRY_COUNT,
+                                    delay=util.RETRY_DELAY,
+                                    command_type=util.POWERSHELL,
+                                    policy=None):
+        """Run the given command until the condition *cond* occurs."""
+        return self._submit(self._client.run_command_until_condition,
+                            cmd, cond, retry_count=retry_count,
+                            delay=delay, command_type=command_type,
+                            policy=policy)
+
+    def wait_until(self, condition, **kwargs):
+        """Wait on the instance until the given condition is true."""
+        return self._submit(self._client.wait_until, condition, **kwargs)
+
+    def copy_file(self, filepath, remote_destination, compress=False,
+                  shells=None):
+        """Copy the given filepath in the remote destination."""
+        return self._submit(self._client.copy_file, filepath,
+                            remote_destination, compress=compress,
+                            shells=shells)
+
+    def read_file(self, filepath):
+        """Get the content of the given file."""
+        return self._submit(self._client.read_file, filepath)
+
+    def download_file(self, filepath, local_destination, **kwargs):
+        """Copy the given remote file to a local destination."""
+        return self._submit(self._client.download_file, filepath,
+                            local_destination, **kwargs)
+
+    def close(self):
+        """Release the resources held by the underlying client."""
+        return self._submit(self._client.close)
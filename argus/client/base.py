@@ -41,3 +41,6 @@ class BaseClient(object):
         It will return a tuple of three elements, stdout, stderr
         and the return code of the command.
         """
+
+    def close(self):
+        """Release the resources held by the client, if any."""
@@ -0,0 +1,111 @@
+# Copyright 2016 Cloudbase Solutions Srl
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Run the same work on many remote clients at once."""
+
+import collections
+import threading
+
+import six
+
+from argus import util
+
+
+LOG = util.get_logger()
+DEFAULT_WORKERS = 8
+
+
+class HostResult(collections.namedtuple('HostResult',
+                                        'client result error')):
+    """The outcome of the work done with one of the clients.
+
+    *result* is what the work returned, while *error* is the
+    exception raised by it, if it failed.
+    """
+
+    __slots__ = ()
+
+    @property
+    def failed(self):
+        return self.error is not None
+
+
+class FanOutExecutor(object):
+    """Run work on many remote clients, with a bounded pool of workers.
+
+    The results are given back as soon as they arrive, in the order
+    in which the clients finish, so a slow or unreachable instance
+    doesn't hold back the results of the others. The failures are
+    reported for each client, without stopping the work on the
+    other ones.
+
+    :param clients: The remote clients to use.
+    :param max_workers:
+        The maximum number of clients used at the same time.
+    """
+
+    def __init__(self, clients, max_workers=DEFAULT_WORKERS):
+        self._clients = list(clients)
+        self._max_workers = max(1, max_workers)
+
+    def _work(self, function, clients, results):
+        while True:
+            try:
+                client = clients.get_nowait()
+            except six.moves.queue.Empty:
+                return
+            try:
+                result = HostResult(client, function(client), None)
+            except Exception as exc:  # pylint: disable=broad-except
+                LOG.debug("The work on %r failed with %r.", client, exc)
+                result = HostResult(client, None, exc)
+            results.put(result)
+
+    def map(self, function):
+        """Call *function* with every client.
+
+        :returns:
+            A generator of :class:`HostResult`, in the order
+            in which the calls finish.
+        """
+        clients = six.moves.queue.Queue()
+        results = six.moves.queue.Queue()
+        for client in self._clients:
+            clients.put(client)
+
+        for _ in range(min(self._max_workers, len(self._clients))):
+            worker = threading.Thread(target=self._work,
+                                      args=(function, clients, results))
+            worker.daemon = True
+            worker.start()
+
+        for _ in range(len(self._clients)):
+            yield results.get()
+
+    def run_command(self, cmd, command_type=util.POWERSHELL):
+        """Run the given command on every client.
+
+        The result of every successful command is a tuple of
+        stdout, stderr and the exit code.
+        """
+        return self.map(
+            lambda client: client.run_command(cmd, command_type=command_type))
+
+    def run_command_with_retry(self, cmd, command_type=util.POWERSHELL,
+                               **kwargs):
+        """Run the given command on every client, until it succeeds."""
+        return self.map(
+            lambda client: client.run_command_with_retry(
+                cmd, command_type=command_type, **kwargs))
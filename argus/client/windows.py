@@ -16,11 +16,26 @@
 #    under the License.
 
 import base64
-import functools
+import codecs
+import collections
+import contextlib
+import gzip
+import hashlib
+import itertools
+import os
+import random
+import shutil
+import socket
+import tempfile
+import textwrap
+import threading
 import time
 
+import requests
 import six
+from winrm import exceptions as winrm_exceptions
 from winrm import protocol
+import xmltodict
 
 from argus.client import base
 from argus import exceptions
@@ -31,16 +46,714 @@ from argus.action_manager.windows import get_windows_action_manager
 LOG = util.get_logger()
 CODEPAGE_UTF8 = 65001
 
+# The default MaxEnvelopeSizekb of WinRM, used when the instance
+# can't tell the configured one.
+DEFAULT_MAX_ENVELOPE_SIZE = 150 * 1024
+# Room left in an envelope for the SOAP headers.
+ENVELOPE_OVERHEAD = 4096
+# The size of the ranges read by iter_file.
+DEFAULT_READ_CHUNK_SIZE = 1024 * 1024
+# The operation timeout used with the older versions of pywinrm,
+# which don't retry the operations which timed out.
+OPERATION_TIMEOUT = "PT3600S"
+# The seconds after which an unused protocol client is closed.
+POOL_IDLE_TIMEOUT = 60
+# The default number of seconds for waiting on a condition.
+WAIT_TIMEOUT = util.RETRY_COUNT * util.RETRY_DELAY
 
-def _base64_read_file(filepath, size=8192):
+# The maximum length of a command line that can be given to WinRM,
+# which runs it through cmd.exe, limited to 8191 characters.
+MAX_COMMAND_LENGTH = 8000
+
+# Template for running a batch of commands in a single remote invocation.
+# Every command is executed through cmd.exe, exactly how WinRM does it,
+# and its output is written as a record line of the following format:
+# <boundary>:<index>:<exit code>:<base64 stdout>:<base64 stderr>
+BATCH_SCRIPT = textwrap.dedent("""
+    $commands = @({commands})
+    for ($i = 0; $i -lt $commands.Length; $i++) {{
+        $command = [Text.Encoding]::UTF8.GetString(
+            [Convert]::FromBase64String($commands[$i]))
+        $info = New-Object Diagnostics.ProcessStartInfo
+        $info.FileName = 'cmd.exe'
+        $info.Arguments = '/c ' + $command
+        $info.UseShellExecute = $false
+        $info.RedirectStandardOutput = $true
+        $info.RedirectStandardError = $true
+        $info.StandardOutputEncoding = [Text.Encoding]::UTF8
+        $info.StandardErrorEncoding = [Text.Encoding]::UTF8
+        $process = [Diagnostics.Process]::Start($info)
+        $stdout = $process.StandardOutput.ReadToEndAsync()
+        $stderr = $process.StandardError.ReadToEndAsync()
+        $process.WaitForExit()
+        $record = @('{boundary}', $i, $process.ExitCode) + @(
+            $stdout.Result, $stderr.Result | foreach {{
+                [Convert]::ToBase64String([Text.Encoding]::UTF8.GetBytes($_))
+            }})
+        [Console]::Out.WriteLine($record -join ':')
+    }}
+""")
+
+SHELL_RESOURCE_URI = ('http://schemas.microsoft.com/wbem/wsman/1/windows/'
+                      'shell/cmd')
+SEND_ACTION = 'http://schemas.microsoft.com/wbem/wsman/1/windows/shell/Send'
+
+# A PowerShell process which executes the commands read from its stdin.
+HOST_COMMAND = ("powershell -NoLogo -NoProfile -NonInteractive "
+                "-ExecutionPolicy Bypass -Command -")
+
+# Every command sent to the PowerShell host is wrapped in a single line,
+# which captures its output and writes it as a record line of the
+# following format: <boundary>:<exit code>:<base64 stdout>:<base64 stderr>
+# The exit code follows the one of `powershell -EncodedCommand`, being
+# 1 when the last statement of the command failed.
+HOST_WRAPPER = (
+    "& {{ $command = [Text.Encoding]::UTF8.GetString("
+    "[Convert]::FromBase64String('{command}')); "
+    "$global:LASTEXITCODE = 0; $global:argusStatus = $false; "
+    "$failed = $false; "
+    "try {{ $output = & $global:argusInvoke ([ScriptBlock]::Create("
+    "$command + \"`n`$global:argusStatus = `$?\")) }} "
+    "catch {{ $failed = $true; $output = @($_) }}; "
+    "$stdout = $output | where {{ "
+    "$_ -isnot [Management.Automation.ErrorRecord] }} | Out-String; "
+    "$stderr = $output | where {{ "
+    "$_ -is [Management.Automation.ErrorRecord] }} | Out-String; "
+    "$exitCode = 0; "
+    "if ($failed -or -not $global:argusStatus) {{ $exitCode = 1 }}; "
+    "$record = @('{boundary}', $exitCode) + @($stdout, $stderr | foreach {{ "
+    "[Convert]::ToBase64String([Text.Encoding]::UTF8.GetBytes($_)) }}); "
+    "[Console]::Out.WriteLine($record -join ':') }}\r\n"
+)
+# The commands are invoked with their streams redirected to the output,
+# so that the output of Write-Host is captured as well. It goes to the
+# information stream since PowerShell 5, while the older versions,
+# which can't redirect it, get a Write-Host which writes to the output.
+HOST_PROLOGUE = (
+    "$ProgressPreference = 'SilentlyContinue'\r\n"
+    "$argusRedirect = '2>&1'; "
+    "if ($PSVersionTable.PSVersion.Major -ge 5) { $argusRedirect = '*>&1' }; "
+    "$global:argusInvoke = [ScriptBlock]::Create("
+    "\"param(`$block) & `$block $argusRedirect\")\r\n"
+    "if ($PSVersionTable.PSVersion.Major -lt 5) { "
+    "function global:Write-Host { param("
+    "[Parameter(ValueFromRemainingArguments=$true)] $Object, "
+    "[switch] $NoNewline, $Separator = ' ', $ForegroundColor, "
+    "$BackgroundColor) ($Object | foreach { \"$_\" }) -join $Separator } "
+    "}\r\n"
+)
+
+# Write the base64 encoded lines received through stdin to a file.
+UPLOAD_SCRIPT = textwrap.dedent("""
+    $path = [Text.Encoding]::UTF8.GetString(
+        [Convert]::FromBase64String('{path}'))
+    $stream = [IO.File]::Create($path)
+    try {{
+        while (($line = [Console]::In.ReadLine()) -ne $null) {{
+            if (-not $line) {{ continue }}
+            $data = [Convert]::FromBase64String($line)
+            $stream.Write($data, 0, $data.Length)
+        }}
+    }} finally {{
+        $stream.Dispose()
+    }}
+""")
+
+# Evaluate a condition on the instance until it is true or
+# until the timeout expires, printing the final result.
+WAIT_SCRIPT = textwrap.dedent("""
+    $deadline = [DateTime]::UtcNow.AddSeconds({timeout})
+    while ($true) {{
+        try {{
+            $met = [bool](& {{ {condition} }})
+        }} catch {{
+            $met = $false
+        }}
+        if ($met -or [DateTime]::UtcNow -ge $deadline) {{
+            break
+        }}
+        Start-Sleep -Milliseconds {interval}
+    }}
+    $met
+""")
+
+# Read a range of a file and print it encoded with base64.
+READ_RANGE_SCRIPT = textwrap.dedent("""
+    $path = [Text.Encoding]::UTF8.GetString(
+        [Convert]::FromBase64String('{path}'))
+    $stream = New-Object IO.FileStream(
+        $path, [IO.FileMode]::Open, [IO.FileAccess]::Read,
+        [IO.FileShare]::ReadWrite)
+    try {{
+        [void]$stream.Seek({offset}, [IO.SeekOrigin]::Begin)
+        $buffer = New-Object byte[] {size}
+        $read = $stream.Read($buffer, 0, $buffer.Length)
+        [Convert]::ToBase64String($buffer, 0, $read)
+    }} finally {{
+        $stream.Dispose()
+    }}
+""")
+
+# Join the uploaded parts into the destination, decompressing them
+# if needed, and print the SHA-256 checksum of the result.
+FINALIZE_UPLOAD_SCRIPT = textwrap.dedent("""
+    function Decode($value) {{
+        [Text.Encoding]::UTF8.GetString([Convert]::FromBase64String($value))
+    }}
+    $path = Decode '{path}'
+    $parts = @(@({parts}) | foreach {{ Decode $_ }})
+    $compressed = {compressed}
+
+    $joined = $parts[0]
+    if ($parts.Length -gt 1) {{
+        $joined = $path + '.argus-joined'
+        $stream = [IO.File]::Create($joined)
+        try {{
+            foreach ($part in $parts) {{
+                $source = [IO.File]::OpenRead($part)
+                try {{ $source.CopyTo($stream) }}
+                finally {{ $source.Dispose() }}
+                Remove-Item -Force $part
+            }}
+        }} finally {{
+            $stream.Dispose()
+        }}
+    }}
+    if ($compressed) {{
+        $source = New-Object IO.Compression.GZipStream(
+            [IO.File]::OpenRead($joined),
+            [IO.Compression.CompressionMode]::Decompress)
+        $stream = [IO.File]::Create($path)
+        try {{ $source.CopyTo($stream) }} finally {{
+            $stream.Dispose()
+            $source.Dispose()
+        }}
+        Remove-Item -Force $joined
+    }} elseif ($joined -ne $path) {{
+        Move-Item -Force $joined $path
+    }}
+
+    $source = [IO.File]::OpenRead($path)
+    try {{
+        $hash = [Security.Cryptography.SHA256]::Create().ComputeHash($source)
+    }} finally {{
+        $source.Dispose()
+    }}
+    [BitConverter]::ToString($hash).Replace('-', '').ToLower()
+""")
+
+# Errors which mean that the underlying shell can't be used anymore,
+# usually because the instance was rebooted or the connection dropped.
+SHELL_ERRORS = (socket.error, winrm_exceptions.WinRMTransportError,
+                requests.ConnectionError, requests.Timeout)
+if hasattr(winrm_exceptions, "WSManFaultError"):
+    # The newer pywinrm versions raise this for the requests
+    # made on a shell which doesn't exist anymore.
+    SHELL_ERRORS += (winrm_exceptions.WSManFaultError, )
+# The names of the output streams of a command.
+STREAMS = ("stdout", "stderr")
+# Errors caused by wrong credentials. These are retried by default,
+# since the password of a user is expected to be rejected while it is
+# changed, but a :class:`RetryPolicy` can be told to give up on them.
+# Not all of them exist in every pywinrm version.
+AUTH_ERRORS = tuple(
+    getattr(winrm_exceptions, name)
+    for name in ("InvalidCredentialsError", "AuthenticationError",
+                 "BasicAuthDisabledError", "UnauthorizedError")
+    if hasattr(winrm_exceptions, name))
+
+
+def _sha256(filepath, size=65536):
+    digest = hashlib.sha256()
     with open(filepath, 'rb') as stream:
-        reader = functools.partial(stream.read, size)
-        for data in iter(reader, b''):
-            encoded = base64.b64encode(data)
+        for data in iter(lambda: stream.read(size), b''):
+            digest.update(data)
+    return digest.hexdigest()
+
+
+@contextlib.contextmanager
+def _upload_source(filepath, compress=False):
+    """Get the path of the file to upload, compressing it if requested."""
+    if not compress:
+        yield filepath
+        return
+
+    fd, compressed = tempfile.mkstemp(suffix='.gz')
+    try:
+        with os.fdopen(fd, 'wb') as destination:
+            with open(filepath, 'rb') as source:
+                with gzip.GzipFile(fileobj=destination, mode='wb') as stream:
+                    shutil.copyfileobj(source, stream)
+        yield compressed
+    finally:
+        os.remove(compressed)
+
+
+def _split_ranges(length, parts, alignment):
+    """Split *length* bytes in at most *parts* aligned ranges."""
+    size = -(-length // max(parts, 1))
+    size = max(-(-size // alignment) * alignment, alignment)
+    return [(offset, min(size, length - offset))
+            for offset in six.moves.range(0, length, size)] or [(0, 0)]
+
+
+def _base64_encode(text):
+    encoded = base64.b64encode(text.encode('utf-8'))
+    if six.PY3:
+        encoded = encoded.decode()
+    return encoded
+
+
+def _decode_output(data):
+    if six.PY3:
+        data = data.decode('utf-8', 'replace')
+    return data
+
+
+def _base64_decode(encoded):
+    decoded = base64.b64decode(encoded)
+    if six.PY3:
+        decoded = decoded.decode('utf-8')
+    return decoded
+
+
+def _send_input(protocol_client, shell_id, command_id, data, end=False):
+    """Send the given bytes to the stdin of a running command."""
+    send_command_input = getattr(protocol_client, 'send_command_input', None)
+    if send_command_input is not None:
+        send_command_input(shell_id, command_id, data, end)
+        return
+
+    # Older pywinrm releases can't send input, so build the message here.
+    # pylint: disable=protected-access
+    req = {'env:Envelope': protocol_client._get_soap_header(
+        resource_uri=SHELL_RESOURCE_URI,
+        action=SEND_ACTION,
+        shell_id=shell_id)}
+    stream = req['env:Envelope'].setdefault('env:Body', {}).setdefault(
+        'rsp:Send', {}).setdefault('rsp:Stream', {})
+    stream['@Name'] = 'stdin'
+    stream['@CommandId'] = command_id
+    stream['@End'] = str(end).lower()
+    encoded = base64.b64encode(data)
+    if six.PY3:
+        encoded = encoded.decode()
+    stream['#text'] = encoded
+    protocol_client.send_message(xmltodict.unparse(req))
+
+
+def _receive_output(protocol_client, shell_id, command_id):
+    """Receive the output written by a command since the last call.
+
+    :rtype: tuple
+    :returns: stdout, stderr, exit_code, command_done
+    """
+    receive = getattr(protocol_client, 'get_command_output_raw', None)
+    if receive is None:
+        # pylint: disable=protected-access; older pywinrm releases
+        receive = protocol_client._raw_get_command_output
+    try:
+        return receive(shell_id, command_id)
+    except winrm_exceptions.WinRMOperationTimeoutError:
+        # Nothing was written by the command in the meantime.
+        return b'', b'', -1, False
+
+
+def _batch_script(batch, boundary):
+    return BATCH_SCRIPT.format(
+        boundary=boundary,
+        commands=", ".join("'{}'".format(item) for item in batch))
+
+
+def _fits(script, max_length):
+    """Check if the script fits in a command line, once it is encoded."""
+    return len(util.get_command(script, util.POWERSHELL)) <= max_length
+
+
+def _build_batches(commands, max_length=MAX_COMMAND_LENGTH):
+    """Split the encoded commands in batches which fit in a command line.
+
+    The length of every batch is checked after it is encoded by
+    :func:`util.get_command`, which makes it about 8/3 times larger.
+
+    :returns:
+        A generator of ``(boundary, batch)`` tuples, where *boundary*
+        is the one the batch was checked with.
+    :raises:
+        `ArgusError` if a command doesn't fit in a batch by itself.
+    """
+    boundary, batch = util.rand_name("argus"), []
+    for command in commands:
+        if batch and not _fits(_batch_script(batch + [command], boundary),
+                               max_length):
+            yield boundary, batch
+            boundary, batch = util.rand_name("argus"), []
+        if not batch and not _fits(_batch_script([command], boundary),
+                                   max_length):
+            raise exceptions.ArgusError(
+                "The command {!r} is too long for a batch."
+                .format(_base64_decode(command)))
+        batch.append(command)
+    if batch:
+        yield boundary, batch
+
+
+def _parse_batch_output(output, boundary, count):
+    """Get the results of the commands from the output of a batch."""
+    results = {}
+    for line in output.splitlines():
+        if not line.startswith(boundary + ":"):
+            continue
+        _, index, exit_code, stdout, stderr = line.strip().split(":")
+        results[int(index)] = (_base64_decode(stdout),
+                               _base64_decode(stderr),
+                               int(exit_code))
+    if len(results) != count:
+        raise exceptions.ArgusError(
+            "Expected the results of {} commands, got {}."
+            .format(count, len(results)))
+    return [results[index] for index in range(count)]
+
+
+class ProtocolPool(object):
+    """A pool of WinRM protocol clients, shared by the remote clients.
+
+    Each protocol client holds its own HTTP session, so reusing them
+    keeps the connections alive between commands, skipping the
+    TCP and TLS handshakes. The protocol clients are pooled per
+    endpoint, user and authentication details and a protocol client
+    is used by a single thread at a time. The ones which weren't
+    used for *idle_timeout* seconds are closed.
+    """
+
+    def __init__(self, idle_timeout=POOL_IDLE_TIMEOUT):
+        self._idle_timeout = idle_timeout
+        self._idle = collections.defaultdict(list)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _close(protocol_client):
+        transport = getattr(protocol_client, "transport", None)
+        close_session = getattr(transport, "close_session", None)
+        if close_session is not None:
+            close_session()
+
+    def _evict(self, now):
+        expired = []
+        with self._lock:
+            for key, entries in list(self._idle.items()):
+                alive = [(protocol_client, last_used)
+                         for protocol_client, last_used in entries
+                         if now - last_used < self._idle_timeout]
+                expired.extend(protocol_client
+                               for protocol_client, last_used in entries
+                               if now - last_used >= self._idle_timeout)
+                if alive:
+                    self._idle[key] = alive
+                else:
+                    del self._idle[key]
+
+        for protocol_client in expired:
+            self.discard(protocol_client)
+
+    def acquire(self, key, factory):
+        """Get an idle protocol client for the given key.
+
+        A new one is created with *factory* if there isn't any.
+        """
+        self._evict(time.time())
+        with self._lock:
+            entries = self._idle.get(key)
+            if entries:
+                protocol_client, _ = entries.pop()
+                return protocol_client
+        protocol_client = factory()
+        protocol_client.argus_pool_key = key
+        return protocol_client
+
+    def release(self, protocol_client):
+        """Give back a protocol client which can be reused."""
+        with self._lock:
+            self._idle[protocol_client.argus_pool_key].append(
+                (protocol_client, time.time()))
+
+    def discard(self, protocol_client):
+        """Close a protocol client which shouldn't be reused."""
+        try:
+            self._close(protocol_client)
+        except Exception as exc:  # pylint: disable=broad-except
+            LOG.debug("Could not close the protocol client: %r.", exc)
+
+    def clear(self):
+        """Close all the idle protocol clients."""
+        with self._lock:
+            entries, self._idle = self._idle, collections.defaultdict(list)
+        for protocol_client, _ in itertools.chain(*entries.values()):
+            self.discard(protocol_client)
+
+
+PROTOCOL_POOL = ProtocolPool()
+
+
+class PowerShellHost(object):
+    """A resident PowerShell process, which runs commands read from stdin.
+
+    This avoids starting a new powershell.exe for every command,
+    while keeping the same stdout, stderr and exit code semantics.
+    The host runs until :meth:`close` is called or until one of the
+    commands exits it, case in which :attr:`alive` becomes False.
+
+    :param protocol_client:
+        The WinRM protocol object used for talking with the instance.
+    :param shell_id:
+        An open shell, in which the host will be started.
+    """
+
+    def __init__(self, protocol_client, shell_id):
+        self._protocol_client = protocol_client
+        self._shell_id = shell_id
+        self._command_id = protocol_client.run_command(
+            shell_id, HOST_COMMAND, console_mode_stdin=False)
+        self.alive = True
+        self._send(HOST_PROLOGUE)
+
+    def _send(self, line):
+        _send_input(self._protocol_client, self._shell_id,
+                    self._command_id, line.encode('ascii'))
+
+    def run(self, command):
+        """Run the given PowerShell command in the host.
+
+        :rtype: tuple
+        :returns: stdout, stderr, exit_code
+        """
+        boundary = util.rand_name("argus")
+        self._send(HOST_WRAPPER.format(command=_base64_encode(command),
+                                       boundary=boundary))
+
+        stdout_buffer, stderr_buffer = [], []
+        while True:
+            stdout, stderr, exit_code, done = _receive_output(
+                self._protocol_client, self._shell_id, self._command_id)
+            stdout_buffer.append(stdout)
+            stderr_buffer.append(stderr)
+            if done:
+                # The command exited the host, so there is no record,
+                # the output and the exit code of the host are the ones
+                # of the command.
+                self.alive = False
+                self._protocol_client.cleanup_command(self._shell_id,
+                                                      self._command_id)
+                return (_decode_output(b''.join(stdout_buffer)),
+                        _decode_output(b''.join(stderr_buffer)),
+                        exit_code)
+
+            output = b''.join(stdout_buffer)
             if six.PY3:
-                # Get a string instead.
-                encoded = encoded.decode()
-            yield encoded
+                output = output.decode('ascii', 'replace')
+            # The last line is skipped, since it might be incomplete.
+            for line in output.split("\n")[:-1]:
+                # Anything written by the host without a trailing
+                # new line can be found in front of the record.
+                _, found, record = line.partition(boundary + ":")
+                if found:
+                    exit_code, stdout, stderr = record.strip().split(":")
+                    return (_base64_decode(stdout), _base64_decode(stderr),
+                            int(exit_code))
+
+    def close(self):
+        """Stop the host, by closing its stdin."""
+        if not self.alive:
+            return
+        self.alive = False
+        try:
+            _send_input(self._protocol_client, self._shell_id,
+                        self._command_id, b'', end=True)
+        finally:
+            self._protocol_client.cleanup_command(self._shell_id,
+                                                  self._command_id)
+
+
+class FactCache(object):
+    """Cache the facts about an instance which don't change while it runs.
+
+    The facts are bound to the boot of the instance in which they were
+    taken, identified by its LastBootUpTime. They are dropped with
+    :meth:`clear`, when the instance is known to boot again. After
+    :meth:`invalidate`, when it might have booted again, the boot ID
+    is checked before using them once more.
+
+    :param client: The client of the instance.
+    """
+
+    BOOT_ID_COMMAND = "(Get-WmiObject Win32_OperatingSystem).LastBootUpTime"
+
+    def __init__(self, client):
+        self._client = client
+        self._facts = {}
+        self._boot_id = None
+        self._verify = False
+        self._lock = threading.RLock()
+
+    def _get_boot_id(self):
+        stdout, _, _ = self._client.run_remote_cmd(
+            self.BOOT_ID_COMMAND, command_type=util.POWERSHELL)
+        return stdout.strip()
+
+    def get(self, name, compute):
+        """Get the fact called *name*, computing it if it is not known.
+
+        *compute* is called without arguments and its result is
+        cached, unless it is ``None`` or it raises an exception.
+        """
+        with self._lock:
+            if self._verify and self._facts:
+                boot_id = self._get_boot_id()
+                if boot_id != self._boot_id:
+                    LOG.debug("The instance rebooted, dropping its facts.")
+                    self._facts.clear()
+                    self._boot_id = boot_id
+            self._verify = False
+
+            if name not in self._facts:
+                if self._boot_id is None:
+                    self._boot_id = self._get_boot_id()
+                value = compute()
+                if value is None:
+                    return value
+                self._facts[name] = value
+            return self._facts[name]
+
+    def invalidate(self):
+        """Check the boot ID of the instance before using the facts again."""
+        with self._lock:
+            self._verify = True
+
+    def clear(self):
+        """Forget every fact, because the instance boots again."""
+        with self._lock:
+            self._facts.clear()
+            self._boot_id = None
+            self._verify = False
+
+
+class RetryPolicy(object):
+    """Tell if and when a failed remote command should be retried.
+
+    The delays between the attempts grow exponentially, with some
+    random jitter, up to *delay*. Connection errors start from
+    the shorter *connection_delay*, since a dropped connection is
+    usually back soon, while the failed commands and the unmet
+    conditions start from *command_delay*.
+
+    :param count:
+        Without a *deadline*, the command is retried until it slept
+        for as long as *count* attempts, *delay* seconds apart, would
+        have slept, which leaves room for more attempts, since the
+        first delays are shorter. With a *deadline*, this is the
+        maximum number of attempts instead. If it is ``None``, the
+        command is retried until the *deadline* is reached, if any,
+        or forever.
+    :param delay:
+        The maximum number of seconds to wait between two attempts.
+    :param deadline:
+        The maximum number of seconds for all the attempts, including
+        the time spent running the command. There is no deadline
+        by default.
+    :param retry_command_errors:
+        Retry the commands which finished with a non-zero exit code.
+        This should be disabled for deterministic commands, whose
+        result won't change by running them again.
+    :param fatal_errors:
+        A tuple of errors which are raised right away, instead of
+        being retried, such as :data:`AUTH_ERRORS`.
+    """
+
+    def __init__(self, count=util.RETRY_COUNT, delay=util.RETRY_DELAY,
+                 connection_delay=1, command_delay=2, backoff=2, jitter=0.5,
+                 deadline=None, retry_command_errors=True, fatal_errors=()):
+        self.count = count if count and count > 0 else None
+        self.sleep_budget = None
+        if deadline is None and self.count:
+            # Keep the total sleep of the constant delays used before.
+            self.sleep_budget = self.count * delay
+            self.count = None
+        self.delay = delay
+        self.connection_delay = min(connection_delay, delay)
+        self.command_delay = min(command_delay, delay)
+        self.backoff = backoff
+        self.jitter = jitter
+        self.deadline = deadline
+        self.retry_command_errors = retry_command_errors
+        self.fatal_errors = tuple(fatal_errors)
+
+    def is_fatal(self, exc):
+        """Check if the given error shouldn't be retried."""
+        if self.fatal_errors and isinstance(exc, self.fatal_errors):
+            return True
+        return (not self.retry_command_errors and
+                isinstance(exc, exceptions.ArgusCommandError))
+
+    def get_delay(self, attempt, exc=None):
+        """Get the delay before retrying after the given failed attempt.
+
+        :param attempt: The number of the failed attempt, from 1.
+        :param exc: The error of the attempt, if it raised one.
+        """
+        delay = self.command_delay
+        if isinstance(exc, SHELL_ERRORS):
+            delay = self.connection_delay
+        delay = min(delay * self.backoff ** min(attempt - 1, 32), self.delay)
+        return delay * (1 - self.jitter * random.random())
+
+    def start(self):
+        """Start retrying a command, returning a :class:`Retry`."""
+        return Retry(self)
+
+
+class Retry(object):
+    """The state of a command retried according to a :class:`RetryPolicy`."""
+
+    def __init__(self, policy):
+        self._policy = policy
+        self._attempt = 0
+        self._slept = 0
+        self._start = time.time()
+
+    def failed(self, description, exc=None):
+        """Wait before the next attempt, after a failed one.
+
+        :param exc:
+            The error of the attempt, if any. It is raised again if
+            it is a fatal one.
+        :raises:
+            `ArgusTimeoutError` if there are no attempts left.
+        """
+        policy = self._policy
+        self._attempt += 1
+        if exc is not None and policy.is_fatal(exc):
+            raise exc
+        if policy.count and self._attempt >= policy.count:
+            raise exceptions.ArgusTimeoutError(
+                "Command {!r} failed too many times.".format(description))
+
+        delay = policy.get_delay(self._attempt, exc)
+        if policy.sleep_budget is not None:
+            remaining = policy.sleep_budget - self._slept
+            if remaining <= 0:
+                raise exceptions.ArgusTimeoutError(
+                    "Command {!r} failed too many times.".format(description))
+            delay = min(delay, remaining)
+        if policy.deadline is not None:
+            remaining = policy.deadline - (time.time() - self._start)
+            if remaining <= 0:
+                raise exceptions.ArgusTimeoutError(
+                    "Command {!r} didn't succeed in {} seconds."
+                    .format(description, policy.deadline))
+            delay = min(delay, remaining)
+        LOG.debug("Retrying in %.1f seconds...", delay)
+        time.sleep(delay)
+        self._slept += delay
 
 
 class WinRemoteClient(base.BaseClient):
@@ -56,10 +769,26 @@ class WinRemoteClient(base.BaseClient):
         Client authentication certificate file path in PEM format.
     :param cert_key:
         Client authentication certificate key file path in PEM format.
+    :param persistent_shell:
+        Keep a single shell open for all the commands executed by this
+        client, instead of opening a new one for each call. The shell
+        is reopened when it can't be used anymore and it is released
+        with :meth:`close`.
+    :param powershell_host:
+        Run the PowerShell commands in a resident :class:`PowerShellHost`,
+        started in the persistent shell, instead of starting a new
+        powershell.exe for each one of them. This implies
+        *persistent_shell*.
+    :param upload_shells:
+        The default number of shells used in parallel by
+        :meth:`copy_file`.
+    :param instance_id:
+        The ID of the instance, used for remembering its OS type.
     """
     def __init__(self, hostname, username, password,
                  transport_protocol='http',
-                 cert_pem=None, cert_key=None):
+                 cert_pem=None, cert_key=None, persistent_shell=False,
+                 powershell_host=False, upload_shells=1, instance_id=None):
         super(WinRemoteClient, self).__init__(hostname)
         self._hostname = "{protocol}://{hostname}:{port}/wsman".format(
             protocol=transport_protocol,
@@ -69,10 +798,69 @@ class WinRemoteClient(base.BaseClient):
         self._password = password
         self._cert_pem = cert_pem
         self._cert_key = cert_key
-        self.manager = get_windows_action_manager(self)
+        self._persistent_shell = persistent_shell or powershell_host
+        self._powershell_host = powershell_host
+        self._upload_shells = upload_shells
+        self._shell = None
+        self._host = None
+        self._shell_lock = threading.RLock()
+        self.facts = FactCache(self)
+        self._instance_id = instance_id
+        self._manager = None
+        self._manager_lock = threading.Lock()
+
+    @property
+    def manager(self):
+        """The action manager for the OS of the instance.
+
+        It is created when it is first needed, since this requires
+        waiting for the instance to boot and detecting its OS.
+        """
+        with self._manager_lock:
+            if self._manager is None:
+                self._manager = get_windows_action_manager(
+                    self, self._instance_id)
+            return self._manager
+
+    @manager.setter
+    def manager(self, manager):
+        with self._manager_lock:
+            self._manager = manager
+
+    def prefetch_manager(self):
+        """Start creating the action manager in the background.
+
+        This lets the OS detection overlap with other work. Accessing
+        :attr:`manager` waits for it to finish, and if it failed,
+        the manager is created again by the caller.
+        """
+        def prefetch():
+            try:
+                return self.manager
+            except Exception as exc:  # pylint: disable=broad-except
+                LOG.debug("Could not prefetch the action manager: %r.", exc)
+
+        thread = threading.Thread(target=prefetch)
+        thread.daemon = True
+        thread.start()
 
     @staticmethod
-    def _run_command(protocol_client, shell_id, command,
+    def _check_result(command, encoded_command, result):
+        stdout, stderr, exit_code = result
+        if exit_code:
+            output = "\n\n".join([out for out in (stdout, stderr) if out])
+            raise exceptions.ArgusCommandError(
+                "Executing command {command!r} with encoded Command"
+                "{encoded_command!r} failed with exit code {exit_code!r}"
+                " and output {output!r}."
+                .format(command=command,
+                        encoded_command=encoded_command,
+                        exit_code=exit_code,
+                        output=output))
+        return result
+
+    @classmethod
+    def _run_command(cls, protocol_client, shell_id, command,
                      command_type=util.POWERSHELL):
         command_id = None
         bare_command = command
@@ -81,42 +869,173 @@ class WinRemoteClient(base.BaseClient):
 
         try:
             command_id = protocol_client.run_command(shell_id, command)
-            stdout, stderr, exit_code = protocol_client.get_command_output(
-                shell_id, command_id)
-            if exit_code:
-                output = "\n\n".join([out for out in (stdout, stderr) if out])
-                raise exceptions.ArgusError(
-                    "Executing command {command!r} with encoded Command"
-                    "{encoded_command!r} failed with exit code {exit_code!r}"
-                    " and output {output!r}."
-                    .format(command=bare_command,
-                            encoded_command=command,
-                            exit_code=exit_code,
-                            output=output))
-
-            return stdout, stderr, exit_code
+            result = protocol_client.get_command_output(shell_id, command_id)
+            return cls._check_result(bare_command, command, result)
         finally:
             protocol_client.cleanup_command(shell_id, command_id)
 
+    @classmethod
+    def _upload_stream(cls, protocol_client, shell_id, stream, remote_path,
+                       chunk_size, length=None):
+        """Upload the content of a local stream to a remote file.
+
+        The data is sent through the stdin of a single remote process,
+        in chunks of *chunk_size* bytes. If *length* is given, only
+        that many bytes are read from the stream.
+        """
+        script = UPLOAD_SCRIPT.format(path=_base64_encode(remote_path))
+        command = util.get_command(script, util.POWERSHELL)
+        command_id = protocol_client.run_command(
+            shell_id, command, console_mode_stdin=False)
+        try:
+            remaining = length
+            while remaining is None or remaining > 0:
+                size = chunk_size
+                if remaining is not None:
+                    size = min(size, remaining)
+                    remaining -= size
+                data = stream.read(size)
+                if not data:
+                    break
+                _send_input(protocol_client, shell_id, command_id,
+                            base64.b64encode(data) + b"\r\n")
+            _send_input(protocol_client, shell_id, command_id, b'', end=True)
+            result = protocol_client.get_command_output(shell_id, command_id)
+            return cls._check_result(script, command, result)
+        finally:
+            protocol_client.cleanup_command(shell_id, command_id)
+
+    @classmethod
+    def _finalize_upload(cls, protocol_client, shell_id, parts,
+                         remote_destination, compressed):
+        """Assemble the uploaded parts and get the remote checksum."""
+        script = FINALIZE_UPLOAD_SCRIPT.format(
+            path=_base64_encode(remote_destination),
+            parts=", ".join("'{}'".format(_base64_encode(part))
+                            for part in parts),
+            compressed="$true" if compressed else "$false")
+        stdout, _, _ = cls._run_command(protocol_client, shell_id, script,
+                                        command_type=util.POWERSHELL)
+        return stdout.strip().splitlines()[-1].strip()
+
+    def _run_host_command(self, protocol_client, shell_id, command):
+        if self._host is None or not self._host.alive:
+            self._host = PowerShellHost(protocol_client, shell_id)
+            LOG.debug("Started a PowerShell host in the shell %s.", shell_id)
+        return self._check_result(command, command, self._host.run(command))
+
     def _run_commands(self, commands, commands_type=util.POWERSHELL):
+        with self._shell_session() as (protocol_client, shell_id):
+            if self._powershell_host and commands_type == util.POWERSHELL:
+                return [self._run_host_command(protocol_client, shell_id,
+                                               command)
+                        for command in commands]
+
+            return [self._run_command(protocol_client, shell_id, command,
+                                      command_type=commands_type)
+                    for command in commands]
+
+    @contextlib.contextmanager
+    def _shell_session(self):
+        """Get a shell for running commands.
+
+        This is the persistent shell, if the client uses one,
+        otherwise a new shell which is closed afterwards.
+        """
+        if not self._persistent_shell:
+            with self._open_shell() as shell:
+                yield shell
+            return
+
+        with self._shell_lock:
+            try:
+                yield self._get_shell()
+            except SHELL_ERRORS as exc:
+                # The shell is gone, most probably because the instance
+                # was rebooted. Drop it, so that the next command
+                # will open a new one.
+                # The shell might not have been opened at all, in which
+                # case its protocol client was discarded already.
+                if self._shell is not None:
+                    LOG.debug("Discarding the persistent shell after %r.",
+                              exc)
+                    protocol_client, _ = self._shell
+                    self._shell = self._host = None
+                    PROTOCOL_POOL.discard(protocol_client)
+                self.facts.invalidate()
+                raise
+
+    @contextlib.contextmanager
+    def _open_shell(self):
+        """Open a new shell, which is closed afterwards."""
         protocol_client = self._get_protocol()
-        shell_id = protocol_client.open_shell(codepage=CODEPAGE_UTF8)
         try:
-            results = [self._run_command(protocol_client, shell_id, command,
-                                         command_type=commands_type)
-                       for command in commands]
-        finally:
-            protocol_client.close_shell(shell_id)
-        return results
+            shell_id = protocol_client.open_shell(codepage=CODEPAGE_UTF8)
+            try:
+                yield protocol_client, shell_id
+            finally:
+                protocol_client.close_shell(shell_id)
+        except SHELL_ERRORS:
+            PROTOCOL_POOL.discard(protocol_client)
+            raise
+        except BaseException:
+            PROTOCOL_POOL.release(protocol_client)
+            raise
+        else:
+            PROTOCOL_POOL.release(protocol_client)
+
+    def _get_shell(self):
+        """Get the persistent shell, opening it if there isn't one."""
+        if self._shell is None:
+            protocol_client = self._get_protocol()
+            try:
+                shell_id = protocol_client.open_shell(codepage=CODEPAGE_UTF8)
+            except Exception:
+                PROTOCOL_POOL.discard(protocol_client)
+                raise
+            LOG.debug("Opened the persistent shell %s.", shell_id)
+            self._shell = protocol_client, shell_id
+        return self._shell
+
+    def close(self):
+        """Close the persistent shell of this client, if there is one."""
+        with self._shell_lock:
+            if self._shell is None:
+                return
+            protocol_client, shell_id = self._shell
+            host, self._shell, self._host = self._host, None, None
+            try:
+                if host is not None:
+                    host.close()
+                protocol_client.close_shell(shell_id)
+            except Exception as exc:  # pylint: disable=broad-except
+                # The shell is probably gone already, together
+                # with the instance which held it.
+                LOG.debug("Could not close the shell %s: %r.",
+                          shell_id, exc)
+                PROTOCOL_POOL.discard(protocol_client)
+            else:
+                PROTOCOL_POOL.release(protocol_client)
+
+    def _create_protocol(self):
+        protocol_client = protocol.Protocol(endpoint=self._hostname,
+                                            transport='plaintext',
+                                            username=self._username,
+                                            password=self._password,
+                                            cert_pem=self._cert_pem,
+                                            cert_key_pem=self._cert_key)
+        if hasattr(protocol_client, "timeout"):
+            protocol_client.timeout = OPERATION_TIMEOUT
+        return protocol_client
 
     def _get_protocol(self):
-        protocol.Protocol.DEFAULT_TIMEOUT = "PT3600S"
-        return protocol.Protocol(endpoint=self._hostname,
-                                 transport='plaintext',
-                                 username=self._username,
-                                 password=self._password,
-                                 cert_pem=self._cert_pem,
-                                 cert_key_pem=self._cert_key)
+        """Get a protocol client from the pool.
+
+        It should be given back with :meth:`ProtocolPool.release`.
+        """
+        key = (self._hostname, self._username, self._password,
+               self._cert_pem, self._cert_key)
+        return PROTOCOL_POOL.acquire(key, self._create_protocol)
 
     def run_remote_cmd(self, cmd, command_type=util.POWERSHELL):
         """Run the given remote command.
@@ -127,33 +1046,190 @@ class WinRemoteClient(base.BaseClient):
         """
         return self._run_commands([cmd], command_type)[0]
 
-    def copy_file(self, filepath, remote_destination):
+    @util.cached_property
+    def max_envelope_size(self):
+        """The maximum size in bytes of a WinRM message for the instance."""
+        cmd = r"(Get-Item WSMan:\localhost\MaxEnvelopeSizekb).Value"
+        try:
+            stdout, _, _ = self.run_remote_cmd(cmd,
+                                               command_type=util.POWERSHELL)
+            return int(stdout.strip()) * 1024
+        except (exceptions.ArgusError, ValueError) as exc:
+            LOG.debug("Could not get the maximum envelope size: %r.", exc)
+            return DEFAULT_MAX_ENVELOPE_SIZE
+
+    @property
+    def _upload_chunk_size(self):
+        # Every chunk is encoded twice with base64, once by us and once
+        # in the SOAP message, making it 16/9 times larger.
+        size = (self.max_envelope_size - ENVELOPE_OVERHEAD) * 9 // 16
+        return size - size % 3
+
+    def _upload_range(self, source, remote_path, offset, length,
+                      chunk_size):
+        """Upload a range of the source file over a new shell."""
+        with self._open_shell() as (protocol_client, shell_id):
+            with open(source, 'rb') as stream:
+                stream.seek(offset)
+                self._upload_stream(protocol_client, shell_id, stream,
+                                    remote_path, chunk_size, length=length)
+
+    def _upload_parallel(self, source, parts, ranges, chunk_size):
+        errors = []
+
+        def upload(part, offset, length):
+            try:
+                self._upload_range(source, part, offset, length, chunk_size)
+            except Exception as exc:
+                LOG.error("Uploading %s failed: %r.", part, exc)
+                errors.append(exc)
+
+        threads = [threading.Thread(target=upload,
+                                    args=(part, offset, length))
+                   for part, (offset, length) in zip(parts, ranges)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+
+    def copy_file(self, filepath, remote_destination, compress=False,
+                  shells=None):
         """Copy the given filepath in the remote destination.
 
         The remote destination is the file name where the content
-        of filepath will be written.
+        of filepath will be written. The content is streamed to a
+        remote process, in chunks as large as the WinRM envelope
+        allows, and the copy is verified with a SHA-256 checksum
+        afterwards.
+
+        :param compress:
+            Compress the content with gzip before sending it,
+            which pays off for large files which compress well.
+        :param shells:
+            The number of shells used in parallel for the upload,
+            each one sending a range of the file into a part file.
+            The parts are joined on the instance at the end.
+            It defaults to the *upload_shells* given to the client.
         """
+        shells = shells or self._upload_shells
+        chunk_size = self._upload_chunk_size
+        start = time.time()
+
+        with _upload_source(filepath, compress) as source:
+            size = os.path.getsize(source)
+            ranges = _split_ranges(size, shells, chunk_size)
+            parts = [remote_destination]
+            if compress or len(ranges) > 1:
+                parts = ["{}.argus-part{}".format(remote_destination, index)
+                         for index in range(len(ranges))]
+            LOG.info("Copying %s to %s using %d shell(s)...",
+                     filepath, remote_destination, len(ranges))
+
+            if len(ranges) > 1:
+                self._upload_parallel(source, parts, ranges, chunk_size)
+
+            with self._shell_session() as (protocol_client, shell_id):
+                if len(ranges) == 1:
+                    with open(source, 'rb') as stream:
+                        self._upload_stream(protocol_client, shell_id,
+                                            stream, parts[0], chunk_size)
+                checksum = self._finalize_upload(
+                    protocol_client, shell_id, parts,
+                    remote_destination, compress)
+
+        elapsed = max(time.time() - start, 1e-6)
+        LOG.info("Copied %d bytes to %s in %.2f seconds (%.0f bytes/s).",
+                 size, remote_destination, elapsed, size / elapsed)
+
+        if checksum != _sha256(filepath):
+            raise exceptions.ArgusError(
+                "The checksum of {!r} doesn't match the one of the local "
+                "file {!r}.".format(remote_destination, filepath))
+
+    def run_commands_batch(self, commands, command_type=util.POWERSHELL,
+                           count=util.RETRY_COUNT, delay=util.RETRY_DELAY):
+        """Run multiple independent commands in a single remote invocation.
 
-        # TODO(cpopa): This powershell dance is a little complicated,
-        # find a simpler way to send a file over a remote server,
-        # without relying on OpenStack infra.
-        get_string_cmd = ("[System.Text.Encoding]::UTF8.GetString("
-                          "[System.Convert]::FromBase64String('{}'))")
-        commands = []
-        for command in _base64_read_file(filepath):
-            remote_command = (
-                "{content} >> {remote_destination}"
-                .format(content=get_string_cmd.format(command),
-                        remote_destination=remote_destination))
-
-            commands.append(remote_command)
-        self._run_commands(commands, commands_type=util.POWERSHELL)
+        The commands are packed together in a script, which runs them
+        one by one, as :meth:`run_command` would, and the results are
+        separated afterwards. If there are too many commands for a
+        single command line, they are split in as few batches as
+        possible. A command which fails doesn't stop the others.
+
+        :param commands:
+            A list of commands which will be executed.
+        :param command_type:
+            The type of the commands, the same for all of them.
+        :param count:
+            The number of retries for every batch.
+        :param delay:
+            The maximum number of seconds to sleep when retrying a batch.
+
+        :rtype: list
+        :returns:
+            A list of (stdout, stderr, exit_code) tuples, one for each
+            command, in the order in which they were given.
+        """
+        encoded = [_base64_encode(util.get_command(command, command_type))
+                   for command in commands]
+        results = []
+        for boundary, batch in _build_batches(encoded):
+            script = _batch_script(batch, boundary)
+            LOG.info("Running a batch of %d commands...", len(batch))
+            stdout, _, _ = self.run_command_with_retry(
+                script, count=count, delay=delay,
+                command_type=util.POWERSHELL)
+            results.extend(_parse_batch_output(stdout, boundary, len(batch)))
+        return results
 
     def read_file(self, filepath):
         """Get the content of the given file."""
         cmd = 'Get-Content "{}"'.format(filepath)
         return self.run_remote_cmd(cmd, command_type=util.POWERSHELL)[0]
 
+    def iter_file(self, filepath, chunk_size=DEFAULT_READ_CHUNK_SIZE,
+                  offset=0):
+        """Read the given remote file in chunks.
+
+        Each chunk is a range of the file, of at most *chunk_size*
+        bytes, read with a separate remote command, which means that
+        neither side holds the whole file in memory.
+
+        :param offset: The position in the file where to start from.
+        :returns: A generator of the raw content of the chunks.
+        """
+        path = _base64_encode(filepath)
+        while True:
+            script = READ_RANGE_SCRIPT.format(path=path, offset=offset,
+                                              size=chunk_size)
+            stdout, _, _ = self.run_remote_cmd(script,
+                                               command_type=util.POWERSHELL)
+            data = base64.b64decode(stdout.strip())
+            if data:
+                offset += len(data)
+                yield data
+            if len(data) < chunk_size:
+                return
+
+    def download_file(self, filepath, local_destination,
+                      chunk_size=DEFAULT_READ_CHUNK_SIZE, offset=0):
+        """Copy the given remote file to a local destination.
+
+        The content is written as it is received, starting with
+        the given *offset* in the remote file.
+
+        :returns: The number of bytes which were written.
+        """
+        written = 0
+        with open(local_destination, 'wb') as stream:
+            for data in self.iter_file(filepath, chunk_size, offset):
+                stream.write(data)
+                written += len(data)
+        return written
+
     def run_command(self, cmd, command_type=util.POWERSHELL):
         """Run the given command and return execution details.
 
@@ -164,6 +1240,63 @@ class WinRemoteClient(base.BaseClient):
         LOG.info("Running command %s...", cmd)
         return self.run_remote_cmd(cmd, command_type=command_type)
 
+    def iter_command(self, cmd, command_type=util.POWERSHELL):
+        """Run the given command, giving back its output as it is written.
+
+        The output is received in a loop, while the command runs,
+        instead of waiting for the command to finish. Closing the
+        generator before the end terminates the command, which can
+        be used for stopping it early, for instance when its output
+        shows that it failed.
+
+        :returns:
+            A generator of ``(stream, data)`` tuples, where *stream*
+            is either ``"stdout"`` or ``"stderr"``.
+        :raises:
+            `ArgusCommandError` after the output, if the command
+            finished with a non-zero exit code.
+        """
+        LOG.info("Running command %s...", cmd)
+        command = util.get_command(cmd, command_type)
+        decoders = {}
+        if six.PY3:
+            decoders = {
+                stream: codecs.getincrementaldecoder('utf-8')('replace')
+                for stream in STREAMS
+            }
+
+        with self._shell_session() as (protocol_client, shell_id):
+            command_id = protocol_client.run_command(shell_id, command)
+            try:
+                done = False
+                while not done:
+                    stdout, stderr, exit_code, done = _receive_output(
+                        protocol_client, shell_id, command_id)
+                    for stream, data in zip(STREAMS, (stdout, stderr)):
+                        if stream in decoders:
+                            data = decoders[stream].decode(data, done)
+                        if data:
+                            yield stream, data
+            finally:
+                protocol_client.cleanup_command(shell_id, command_id)
+        self._check_result(cmd, command, ('', '', exit_code))
+
+    def run_command_streaming(self, cmd, callback,
+                              command_type=util.POWERSHELL):
+        """Run the given command, passing its output to *callback*.
+
+        The callback is called with the name of the stream, either
+        ``"stdout"`` or ``"stderr"``, and with each piece of output,
+        as soon as it is received. An exception raised by the callback
+        terminates the command and it is propagated to the caller.
+
+        :raises:
+            `ArgusCommandError` if the command finished with a
+            non-zero exit code.
+        """
+        for stream, data in self.iter_command(cmd, command_type):
+            callback(stream, data)
+
     def run_command_verbose(self, cmd, command_type=util.POWERSHELL):
         """Run the given command and log anything it returns.
 
@@ -181,45 +1314,73 @@ class WinRemoteClient(base.BaseClient):
 
     def run_command_with_retry(self, cmd, count=util.RETRY_COUNT,
                                delay=util.RETRY_DELAY,
-                               command_type=util.POWERSHELL):
+                               command_type=util.POWERSHELL, policy=None):
         """Run the given `cmd` until succeeds.
 
         :param cmd:
             A string, representing a command which needs to
             be executed on the underlying remote client.
         :param count:
-            The number of retries which this function has.
+            The number of retries which this function has, as
+            explained by :class:`RetryPolicy`.
             If the value is ``None``, then the function will retry *forever*.
         :param delay:
-            The number of seconds to sleep when retrying a command.
+            The maximum number of seconds to sleep when retrying a command.
+        :param policy:
+            A :class:`RetryPolicy` used instead of the one built
+            from *count* and *delay*.
 
         :rtype: tuple
         :returns: stdout, stderr, exit_code
         """
+        retry = (policy or RetryPolicy(count, delay)).start()
+        while True:
+            try:
+                return self.run_command(cmd, command_type=command_type)
+            except Exception as exc:  # pylint: disable=broad-except
+                LOG.debug("Command failed with %r.", exc)
+                retry.failed(cmd, exc)
+
+    def wait_until(self, condition, timeout=WAIT_TIMEOUT,
+                   interval=1, count=util.RETRY_COUNT,
+                   delay=util.RETRY_DELAY, policy=None):
+        """Wait on the instance until the given condition is true.
 
-        # Countdown normalization.
-        if not count or count < 0:
-            count = 0
+        The condition is a PowerShell expression, which is evaluated
+        in a loop by a single remote command, every *interval* seconds,
+        until it is true or *timeout* seconds pass. This avoids a round
+        trip and a new PowerShell process for every check.
 
+        The remote command is retried only if it fails to run,
+        for instance when the instance is not reachable yet.
+
+        :raises:
+            `ArgusTimeoutError` if the condition wasn't met in time.
+        """
+        script = WAIT_SCRIPT.format(condition=condition, timeout=timeout,
+                                    interval=int(interval * 1000))
+        LOG.info("Waiting for %s...", condition)
+        retry = (policy or RetryPolicy(count, delay)).start()
         while True:
             try:
-                return self.run_command(cmd, command_type=command_type)
+                stdout, _, _ = self.run_command(script,
+                                                command_type=util.POWERSHELL)
             except Exception as exc:  # pylint: disable=broad-except
                 LOG.debug("Command failed with %r.", exc)
-                # A negative `count` means no count at all.
-                if count >= 0:
-                    count -= 1
-                if count == 0:
-                    raise exceptions.ArgusTimeoutError(
-                        "Command {!r} failed too many times."
-                        .format(cmd))
-                LOG.debug("Retrying...")
-                time.sleep(delay)
+                retry.failed(condition, exc)
+                continue
+
+            if stdout.strip() == "True":
+                return
+            raise exceptions.ArgusTimeoutError(
+                "Condition {!r} wasn't met in {} seconds."
+                .format(condition, timeout))
 
     def run_command_until_condition(self, cmd, cond,
                                     retry_count=util.RETRY_COUNT,
                                     delay=util.RETRY_DELAY,
-                                    command_type=util.POWERSHELL):
+                                    command_type=util.POWERSHELL,
+                                    policy=None):
         """Run the given `cmd` until a condition `cond` occurs.
 
         :param cond:
@@ -232,33 +1393,22 @@ class WinRemoteClient(base.BaseClient):
         This method uses and behaves like `run_command_with_retry` but
         with an additional condition parameter.
         """
-
-        # countdown normalization
-        if not retry_count or retry_count < 0:
-            retry_count = 0
-
+        retry = (policy or RetryPolicy(retry_count, delay)).start()
         while True:
             try:
                 stdout, stderr, exit_code = self.run_command(
                     cmd, command_type=command_type)
             except Exception as exc:  # pylint: disable=broad-except
                 LOG.debug("Command failed with %r.", exc)
-            else:
-                if stderr and exit_code:
-                    raise exceptions.ArgusCLIError(
-                        ("Executing command {!r} failed with {!r}"
-                         " and exit code {}.")
-                        .format(cmd, stderr, exit_code))
-                elif cond(stdout):
-                    return
-                else:
-                    LOG.debug("Condition not met, retrying...")
+                retry.failed(cmd, exc)
+                continue
 
-            if retry_count > 0:
-                retry_count -= 1
-                LOG.debug("Retrying...")
-                time.sleep(delay)
-            else:
-                raise exceptions.ArgusTimeoutError(
-                    "Command {!r} failed too many times."
-                    .format(cmd))
+            if stderr and exit_code:
+                raise exceptions.ArgusCLIError(
+                    ("Executing command {!r} failed with {!r}"
+                     " and exit code {}.")
+                    .format(cmd, stderr, exit_code))
+            elif cond(stdout):
+                return
+            LOG.debug("Condition not met, retrying...")
+            retry.failed(cmd)
@@ -37,7 +37,24 @@ class _ConfigParser(six.moves.configparser.ConfigParser):
 def _get_default(parser, section, option, default=None):
     try:
         return parser.get(section, option)
-    except six.moves.configparser.NoOptionError:
+    except (six.moves.configparser.NoOptionError,
+            six.moves.configparser.NoSectionError):
+        return default
+
+
+def _get_default_boolean(parser, section, option, default=False):
+    try:
+        return parser.getboolean(section, option)
+    except (six.moves.configparser.NoOptionError,
+            six.moves.configparser.NoSectionError):
+        return default
+
+
+def _get_default_int(parser, section, option, default=None):
+    try:
+        return parser.getint(section, option)
+    except (six.moves.configparser.NoOptionError,
+            six.moves.configparser.NoSectionError):
         return default
 
 
@@ -59,9 +76,19 @@ class ConfigurationParser(object):
                                        'resources pause '
                                        'file_log log_format dns_nameservers '
                                        'output_directory build arch '
-                                       'patch_install git_command')
+                                       'patch_install git_command '
+                                       'serve_resources resources_port '
+                                       'resources_host '
+                                       'teardown_journal '
+                                       'background_teardown')
         resources = _get_default(
             self._parser, 'argus', 'resources', self.RESOURCES_LINK)
+        serve_resources = _get_default_boolean(
+            self._parser, 'argus', 'serve_resources', False)
+        resources_port = _get_default_int(
+            self._parser, 'argus', 'resources_port', 8181)
+        resources_host = _get_default(self._parser, 'argus',
+                                      'resources_host')
         pause = self._parser.getboolean('argus', 'pause')
         file_log = _get_default(self._parser, 'argus', 'file_log')
         log_format = _get_default(self._parser, 'argus', 'log_format')
@@ -76,10 +103,16 @@ class ConfigurationParser(object):
         arch = _get_default(self._parser, 'argus', 'arch', 'x64')
         patch_install = _get_default(self._parser, 'argus', 'patch_install')
         git_command = _get_default(self._parser, 'argus', 'git_command')
+        teardown_journal = _get_default(self._parser, 'argus',
+                                        'teardown_journal')
+        background_teardown = _get_default_boolean(
+            self._parser, 'argus', 'background_teardown', False)
 
         return argus(resources, pause, file_log, log_format,
                      dns_nameservers, output_directory, build, arch,
-                     patch_install, git_command)
+                     patch_install, git_command, serve_resources,
+                     resources_port, resources_host, teardown_journal,
+                     background_teardown)
 
     @property
     def cloudbaseinit(self):
@@ -97,19 +130,50 @@ class ConfigurationParser(object):
         openstack = collections.namedtuple(
             'openstack',
             'image_ref flavor_ref image_username image_password '
-            'image_os_type require_sysprep')
+            'image_os_type require_sysprep os_type_cache '
+            'image_cache image_cache_max_age image_cache_max_count '
+            'instance_pool_size shared_security_group')
         image_ref = self._parser.get('openstack', 'image_ref')
         flavor_ref = self._parser.get('openstack', 'flavor_ref')
         image_username = self._parser.get('openstack', 'image_username')
         image_password = self._parser.get('openstack', 'image_password')
         image_os_type = self._parser.get('openstack', 'image_os_type')
         require_sysprep = self._parser.get('openstack', 'require_sysprep')
+        os_type_cache = _get_default(self._parser, 'openstack',
+                                     'os_type_cache')
+        image_cache = _get_default_boolean(self._parser, 'openstack',
+                                           'image_cache', False)
+        image_cache_max_age = _get_default_int(
+            self._parser, 'openstack', 'image_cache_max_age', 24)
+        image_cache_max_count = _get_default_int(
+            self._parser, 'openstack', 'image_cache_max_count', 4)
+        instance_pool_size = _get_default_int(
+            self._parser, 'openstack', 'instance_pool_size', 0)
+        shared_security_group = _get_default_boolean(
+            self._parser, 'openstack', 'shared_security_group', False)
 
         return openstack(image_ref, flavor_ref, image_username,
-                         image_password, image_os_type, require_sysprep)
+                         image_password, image_os_type, require_sysprep,
+                         os_type_cache, image_cache, image_cache_max_age,
+                         image_cache_max_count, instance_pool_size,
+                         shared_security_group)
+
+    @property
+    def winrm(self):
+        winrm = collections.namedtuple(
+            'winrm', 'persistent_shell powershell_host upload_shells')
+        persistent_shell = _get_default_boolean(
+            self._parser, 'winrm', 'persistent_shell', False)
+        powershell_host = _get_default_boolean(
+            self._parser, 'winrm', 'powershell_host', False)
+        upload_shells = _get_default_int(
+            self._parser, 'winrm', 'upload_shells', 1)
+
+        return winrm(persistent_shell, powershell_host, upload_shells)
 
     @property
     def conf(self):
         conf = collections.namedtuple(
-            'conf', 'argus cloudbaseinit openstack')
-        return conf(self.argus, self.cloudbaseinit, self.openstack)
+            'conf', 'argus cloudbaseinit openstack winrm')
+        return conf(self.argus, self.cloudbaseinit, self.openstack,
+                    self.winrm)
@@ -25,3 +25,7 @@ class ArgusTimeoutError(ArgusError):
 
 class ArgusCLIError(ArgusError):
     pass
+
+
+class ArgusCommandError(ArgusError):
+    """A remote command finished with a non-zero exit code."""
@@ -15,18 +15,17 @@
 
 
 import collections
-import contextlib
 import ntpath
-import os
 import re
-import shutil
-import tempfile
+import textwrap
 
 from argus.introspection.cloud import base
 from argus import exceptions
 from argus import util
 
 
+LOG = util.get_logger()
+
 # escaped characters for powershell paths
 ESC = "( )"
 SEP = "----\r\n"    # default separator for network details blocks
@@ -35,25 +34,63 @@ NIC_KEYS = ["mac", "address", "gateway", "netmask", "dns", "dhcp"]
 Address = collections.namedtuple("Address", ["v4", "v6"])
 NICDetails = collections.namedtuple("NICDetails", NIC_KEYS)
 
-
-@contextlib.contextmanager
-def _create_tempdir():
-    tempdir = tempfile.mkdtemp(prefix="cloudbaseinit-ci-tests")
-    try:
-        yield tempdir
-    finally:
-        shutil.rmtree(tempdir)
-
-
-@contextlib.contextmanager
-def _create_tempfile(content=None):
-    with _create_tempdir() as temp:
-        file_desc, path = tempfile.mkstemp(dir=temp)
-        os.close(file_desc)
-        if content:
-            with open(path, 'w') as stream:
-                stream.write(content)
-        yield path
+# Merge the given changes into an ini file, replacing the existing
+# options and adding the missing ones at the end of their section.
+# The changes are given as a flat list of section, option and value.
+# The lines before the first section header don't belong to any
+# section, so nothing is added or replaced there.
+MERGE_CONFIG_SCRIPT = textwrap.dedent("""
+    $path = '{path}'
+    $changes = @({changes})
+    $lines = New-Object Collections.ArrayList
+    $done = @{{}}
+
+    function Add-Missing($section) {{
+        for ($i = 0; $i -lt $changes.Length; $i += 3) {{
+            $key = $changes[$i] + "`n" + $changes[$i + 1]
+            if ($changes[$i] -eq $section -and -not $done[$key]) {{
+                [void]$lines.Add($changes[$i + 1] + ' = ' + $changes[$i + 2])
+                $done[$key] = $true
+            }}
+        }}
+    }}
+
+    function Get-Change($section, $option) {{
+        for ($i = 0; $i -lt $changes.Length; $i += 3) {{
+            if ($changes[$i] -eq $section -and $changes[$i + 1] -eq $option) {{
+                return $i
+            }}
+        }}
+        return -1
+    }}
+
+    $section = $null
+    foreach ($line in [IO.File]::ReadAllLines($path)) {{
+        if ($line -match '^\\s*\\[(.+)\\]\\s*$') {{
+            Add-Missing $section
+            $section = $matches[1]
+        }} elseif ($line -match '^\\s*([^#;\\s][^=:]*?)\\s*[=:]') {{
+            $i = Get-Change $section $matches[1]
+            if ($i -ge 0) {{
+                $key = $section + "`n" + $matches[1]
+                if (-not $done[$key]) {{
+                    [void]$lines.Add($matches[1] + ' = ' + $changes[$i + 2])
+                    $done[$key] = $true
+                }}
+                continue
+            }}
+        }}
+        [void]$lines.Add($line)
+    }}
+    Add-Missing $section
+    for ($i = 0; $i -lt $changes.Length; $i += 3) {{
+        if (-not $done[$changes[$i] + "`n" + $changes[$i + 1]]) {{
+            [void]$lines.Add('[' + $changes[$i] + ']')
+            Add-Missing $changes[$i]
+        }}
+    }}
+    [IO.File]::WriteAllLines($path, [string[]]$lines)
+""")
 
 
 def _get_ntp_peers(output):
@@ -123,53 +160,121 @@ def _get_nic_details(details):
     return NICDetails(**nic_details)
 
 
-def get_cbinit_dir(execute_function):
-    """Get the location of cloudbase-init from the instance."""
-    stdout = execute_function(
-        '(Get-WmiObject  Win32_OperatingSystem).'
-        'OSArchitecture', command_type=util.POWERSHELL)
-    architecture = stdout.strip()
+def _get_fact(facts, name, compute):
+    """Get a fact from the given :class:`FactCache`, if there is one."""
+    if facts is None:
+        return compute()
+    return facts.get(name, compute)
+
+
+def get_cbinit_dir(execute_function, facts=None):
+    """Get the location of cloudbase-init from the instance.
+
+    :param facts:
+        An optional :class:`argus.client.windows.FactCache`, which
+        is used for remembering the location.
+    """
+    return _get_fact(facts, "cbinit_dir",
+                     lambda: _get_cbinit_dir(execute_function))
+
+
+def _get_cbinit_dir(execute_function):
+    # Look into both of the program files directories with a single
+    # command, the first one found being the installation location.
+    cmd = ('$locations = @($ENV:ProgramFiles); '
+           'if ((Get-WmiObject Win32_OperatingSystem).OSArchitecture '
+           '-eq "64-bit") { $locations += ${ENV:ProgramFiles(x86)} }; '
+           '$locations | where { Test-Path (Join-Path $_ '
+           '"Cloudbase Solutions") } | select -First 1')
+    location = execute_function(cmd, command_type=util.POWERSHELL).strip()
+    if not location:
+        raise exceptions.ArgusError(
+            'cloudbase-init installation dir not found')
+
+    return ntpath.join(
+        location,
+        "Cloudbase Solutions",
+        "Cloudbase-Init"
+    )
+
+
+def _quote(value):
+    """Quote the given value as a Powershell string literal."""
+    return "'{}'".format(str(value).replace("'", "''"))
+
 
-    locations = [execute_function('powershell "$ENV:ProgramFiles"',
-                                  command_type=util.CMD)]
-    if architecture == '64-bit':
-        location = execute_function(
-            'powershell "${ENV:ProgramFiles(x86)}"',
-            command_type=util.CMD)
-        locations.append(location)
+class ConfigTransaction(object):
+    """Collect changes of cloudbase-init.conf and apply them at once.
 
-    for location in locations:
-        location = location.strip()
-        _location = escape_path(location)
-        status = execute_function(
-            'Test-Path "{}\\Cloudbase` Solutions"'.format(
-                _location), command_type=util.POWERSHELL).strip().lower()
+    The options set through :meth:`set` are only remembered, until
+    :meth:`commit` is called. The configuration file is then updated
+    with a single command, which replaces the options which are
+    already there, instead of duplicating them, and adds the rest.
+    When used as a context manager, the changes are committed
+    at the end of the block, if it finishes successfully.
+    """
 
-        if status == "true":
-            return ntpath.join(
-                location,
-                "Cloudbase Solutions",
-                "Cloudbase-Init"
-            )
+    def __init__(self, execute_function, facts=None):
+        self._execute_function = execute_function
+        self._facts = facts
+        self._changes = collections.OrderedDict()
 
-    raise exceptions.ArgusError('cloudbase-init installation dir not found')
+    def __enter__(self):
+        return self
 
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
 
-def set_config_option(option, value, execute_function):
-    """Set the value for the given *option* to *value*."""
+    @property
+    def changes(self):
+        """The changes which weren't committed yet."""
+        return dict(self._changes)
 
-    line = "{} = {}".format(option, value)
-    cbdir = get_cbinit_dir(execute_function)
-    conf = ntpath.join(cbdir, "conf", "cloudbase-init.conf")
+    def set(self, option, value, section="DEFAULT"):
+        """Set the value for the given *option* to *value*.
 
-    cmd = ('((Get-Content {0!r}) + {1!r}) |'
-           ' Set-Content {0!r}'.format(conf, line))
-    execute_function(cmd, command_type=util.POWERSHELL)
+        The last value given for an option is the one which is written.
+        """
+        self._changes.pop((section, option), None)
+        self._changes[(section, option)] = value
+
+    def commit(self):
+        """Write the collected changes in the configuration file."""
+        if not self._changes:
+            return
+
+        cbdir = get_cbinit_dir(self._execute_function, self._facts)
+        conf = ntpath.join(cbdir, "conf", "cloudbase-init.conf")
+        LOG.info("Setting %s in %s.",
+                 ", ".join(option for _, option in self._changes), conf)
+
+        changes = ", ".join(
+            _quote(item) for (section, option), value in self._changes.items()
+            for item in (section, option, value))
+        cmd = MERGE_CONFIG_SCRIPT.format(path=conf.replace("'", "''"),
+                                         changes=changes)
+        self._execute_function(cmd, command_type=util.POWERSHELL)
+        self._changes.clear()
+
+
+def set_config_option(option, value, execute_function, facts=None):
+    """Set the value for the given *option* to *value*.
+
+    Use a :class:`ConfigTransaction` for setting more options at once.
+    """
+    with ConfigTransaction(execute_function, facts) as transaction:
+        transaction.set(option, value)
 
 
-def get_python_dir(execute_function):
+def get_python_dir(execute_function, facts=None):
     """Find python directory from the cb-init installation."""
-    cbinit_dir = get_cbinit_dir(execute_function)
+    return _get_fact(facts, "python_dir",
+                     lambda: _get_python_dir(execute_function, facts))
+
+
+def _get_python_dir(execute_function, facts=None):
+    cbinit_dir = get_cbinit_dir(execute_function, facts)
     command = 'dir "{}" /b'.format(cbinit_dir)
     stdout = execute_function(command,
                               command_type=util.CMD).strip()
@@ -179,8 +284,13 @@ def get_python_dir(execute_function):
             return ntpath.join(cbinit_dir, name)
 
 
-def get_cbinit_key(execute_function):
+def get_cbinit_key(execute_function, facts=None):
     """Get the proper registry key for Cloudbase-init."""
+    return _get_fact(facts, "cbinit_key",
+                     lambda: _get_cbinit_key(execute_function))
+
+
+def _get_cbinit_key(execute_function):
     key = ("HKLM:SOFTWARE\\Cloudbase` Solutions\\"
            "Cloudbase-init")
     key_x64 = ("HKLM:SOFTWARE\\Wow6432Node\\Cloudbase` Solutions\\"
@@ -260,14 +370,12 @@ class InstanceIntrospection(base.CloudInstanceIntrospection):
         return next(self._parse_netsh_output(stdout), None)
 
     def get_cloudbaseinit_traceback(self):
-        code = util.get_resource('windows/get_traceback.ps1')
-        remote_script = "C:\\{}.ps1".format(util.rand_name())
-        with _create_tempfile(content=code) as tmp:
-            self.remote_client.copy_file(tmp, remote_script)
-            stdout = self.remote_client.run_command_verbose(
-                remote_script,
-                command_type=util.POWERSHELL)
-            return stdout.strip()
+        remote_script = self.remote_client.manager.cache_resource_script(
+            'windows/get_traceback.ps1')
+        stdout = self.remote_client.run_command_verbose(
+            remote_script,
+            command_type=util.POWERSHELL)
+        return stdout.strip()
 
     def _file_exist(self, filepath):
         stdout = self.remote_client.run_command_verbose(
@@ -329,11 +437,17 @@ class InstanceIntrospection(base.CloudInstanceIntrospection):
             'gzip', 'gzip_1',
             'gzip_base64', 'gzip_base64_1', 'gzip_base64_2'
         }
+        basefiles = sorted(expected)
+        cmds = ['cat {}'.format(ntpath.join("C:\\", basefile))
+                for basefile in basefiles]
+        results = self.remote_client.run_commands_batch(
+            cmds, command_type=util.POWERSHELL)
+
         files = {}
-        for basefile in expected:
-            path = ntpath.join("C:\\", basefile)
-            content = self.get_instance_file_content(path)
-            files[basefile] = content.strip()
+        for basefile, (stdout, stderr, exit_code) in zip(basefiles, results):
+            if exit_code:
+                LOG.debug("Reading %s failed with %r.", basefile, stderr)
+            files[basefile] = stdout.strip()
         return files
 
     def get_timezone(self):
@@ -389,11 +503,9 @@ class InstanceIntrospection(base.CloudInstanceIntrospection):
         return nics
 
     def get_user_flags(self, user):
-        code = util.get_resource('windows/get_user_flags.ps1')
-        remote_script = "C:\\{}.ps1".format(util.rand_name())
-        with _create_tempfile(content=code) as tmp:
-            self.remote_client.copy_file(tmp, remote_script)
-            stdout = self.remote_client.run_command_verbose(
-                "{0} {1}".format(remote_script, user),
-                command_type=util.POWERSHELL_SCRIPT_BYPASS)
-            return stdout.strip()
+        remote_script = self.remote_client.manager.cache_resource_script(
+            'windows/get_user_flags.ps1')
+        stdout = self.remote_client.run_command_verbose(
+            "{0} {1}".format(remote_script, user),
+            command_type=util.POWERSHELL_SCRIPT_BYPASS)
+        return stdout.strip()
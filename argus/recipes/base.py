@@ -66,6 +66,19 @@ class BaseRecipe(object):
             cmd, cond, retry_count=count,
             delay=delay, command_type=command_type)
 
+    @classmethod
+    def image_cache_key(cls, conf, **kwargs):
+        """Get the key under which the prepared instances can be cached.
+
+        Instances prepared by recipes with the same key are
+        interchangeable, so they can boot from the same cached image.
+        The recipes which can't be cached return None.
+
+        :param kwargs:
+            The arguments which will be given to :meth:`prepare`.
+        """
+        return None
+
     @abc.abstractmethod
     def prepare(self, **kwargs):
         """Call this method to provision an instance.
@@ -16,6 +16,8 @@
 """Base recipe for preparing instances for cloudbaseinit testing."""
 
 import abc
+import hashlib
+import json
 
 import six
 
@@ -42,6 +44,34 @@ class BaseCloudbaseinitRecipe(base.BaseRecipe):
     * waits for the finalization of the installation.
     """
 
+    resources = ()
+    """The resources used by the recipe."""
+
+    @classmethod
+    def _image_cache_facts(cls, conf, service_type=None):
+        """Get what the preparation of the instance depends on."""
+        return {
+            "image": conf.openstack.image_ref,
+            # The metadata service is written in the configuration.
+            "service_type": service_type,
+            "build": conf.argus.build,
+            "arch": conf.argus.arch,
+            "patch_install": conf.argus.patch_install,
+            "git_command": conf.argus.git_command,
+            "recipe": "{}.{}".format(cls.__module__, cls.__name__),
+            "resources": {
+                resource: hashlib.sha256(
+                    util.get_resource(resource)).hexdigest()
+                for resource in cls.resources
+            },
+        }
+
+    @classmethod
+    def image_cache_key(cls, conf, service_type=None, **kwargs):
+        facts = json.dumps(cls._image_cache_facts(conf, service_type),
+                           sort_keys=True)
+        return hashlib.sha256(facts.encode()).hexdigest()
+
     @abc.abstractmethod
     def wait_for_boot_completion(self):
         """Wait for the instance to finish up booting."""
@@ -93,15 +123,22 @@ class BaseCloudbaseinitRecipe(base.BaseRecipe):
         * get an installation script for CloudbaseInit
         * install CloudbaseInit by running the previously downloaded file.
         * wait until the instance is up and running.
+
+        When the instance was booted from a cached image, it is
+        already prepared up to sysprep.
         """
         LOG.info("Preparing instance...")
         self.wait_for_boot_completion()
         self.execution_prologue()
-        self.get_installation_script()
-        self.install_cbinit(service_type)
-        self.replace_install()
-        self.replace_code()
-        self.pre_sysprep()
+        if self._backend.from_image_cache():
+            LOG.info("The instance was booted from a cached image, "
+                     "it only needs sysprep.")
+        else:
+            self.get_installation_script()
+            self.install_cbinit(service_type)
+            self.replace_install()
+            self.replace_code()
+            self.pre_sysprep()
         if self._conf.argus.pause:
             six.moves.input("Press Enter to continue...")
 
@@ -36,11 +36,34 @@ _CBINIT_REPO = "https://github.com/openstack/cloudbase-init"
 class CloudbaseinitRecipe(base.BaseCloudbaseinitRecipe):
     """Recipe for preparing a Windows instance."""
 
+    # The resources used by the recipe, which are pushed
+    # on the instance at once, before being used.
+    resources = (
+        "windows/common.psm1",
+        "windows/installCBinit.ps1",
+        "windows/schedule_installer.bat",
+        "windows/patch_shell.ps1",
+        "windows/sysprep.ps1",
+        "windows/network_details.ps1",
+    )
+
+    @property
+    def _facts(self):
+        return self._backend.remote_client.facts
+
+    @util.cached_property
+    def _config(self):
+        """The changes of cloudbase-init.conf, written before sysprep."""
+        return introspection.ConfigTransaction(self._execute, self._facts)
+
     def wait_for_boot_completion(self):
         LOG.info("Waiting for first boot completion...")
         self._backend.remote_client.manager.wait_boot_completion()
 
     def execution_prologue(self):
+        self._backend.remote_client.manager.push_resource_bundle(
+            self.resources)
+
         LOG.info("Retrieve common module for proper script execution.")
 
         resource_location = "windows/common.psm1"
@@ -54,7 +77,7 @@ class CloudbaseinitRecipe(base.BaseCloudbaseinitRecipe):
     def install_cbinit(self, service_type):
         """Proceed on checking if cloudbase-init should be installed."""
         try:
-            cbdir = introspection.get_cbinit_dir(self._execute)
+            cbdir = introspection.get_cbinit_dir(self._execute, self._facts)
         except exceptions.ArgusError:
             self._backend.remote_client.manager.install_cbinit(service_type)
             self._grab_cbinit_installation_log()
@@ -70,13 +93,12 @@ class CloudbaseinitRecipe(base.BaseCloudbaseinitRecipe):
                         "the log will not be grabbed.")
             return
 
-        content = self._backend.remote_client.read_file("C:\\installation.log")
         log_template = "installation-{}.log".format(
             self._backend.instance_server()['id'])
 
         path = os.path.join(self._conf.argus.output_directory, log_template)
-        with open(path, 'w') as stream:
-            stream.write(content)
+        self._backend.remote_client.download_file("C:\\installation.log",
+                                                  path)
 
     def replace_install(self):
         """Replace the cb-init installed files with the downloaded ones.
@@ -108,7 +130,7 @@ class CloudbaseinitRecipe(base.BaseCloudbaseinitRecipe):
         self._execute(cmd, command_type=util.POWERSHELL)
 
         LOG.debug("Replace old files with the new ones.")
-        cbdir = introspection.get_cbinit_dir(self._execute)
+        cbdir = introspection.get_cbinit_dir(self._execute, self._facts)
         self._execute('xcopy /y /e /q "C:\\install\\Cloudbase-Init"'
                       ' "{}"'.format(cbdir), command_type=util.CMD)
 
@@ -122,7 +144,7 @@ class CloudbaseinitRecipe(base.BaseCloudbaseinitRecipe):
 
         LOG.info("Getting cloudbase-init location...")
         # Get cb-init python location.
-        python_dir = introspection.get_python_dir(self._execute)
+        python_dir = introspection.get_python_dir(self._execute, self._facts)
 
         # Remove everything from the cloudbaseinit installation.
         LOG.info("Removing recursively cloudbaseinit...")
@@ -165,16 +187,14 @@ class CloudbaseinitRecipe(base.BaseCloudbaseinitRecipe):
         so this is always disabled, excepting tests which sets
         it manual to whatever they want.
         """
-        introspection.set_config_option(
-            option="first_logon_behaviour", value="no",
-            execute_function=self._execute)
+        self._config.set("first_logon_behaviour", "no")
 
         # Patch the installation of cloudbaseinit in order to create
         # a file when the execution ends. We're doing this instead of
         # monitoring the service, because on some OSes, just checking
         # if the service is stopped leads to errors, due to the
         # fact that the service starts later on.
-        python_dir = introspection.get_python_dir(self._execute)
+        python_dir = introspection.get_python_dir(self._execute, self._facts)
         cbinit = ntpath.join(python_dir, 'Lib', 'site-packages',
                              'cloudbaseinit')
 
@@ -189,9 +209,23 @@ class CloudbaseinitRecipe(base.BaseCloudbaseinitRecipe):
 
     def sysprep(self):
         """Prepare the instance for the actual tests, by running sysprep."""
+        self._config.commit()
+        if (self._conf.openstack.image_cache and
+                not self._backend.from_image_cache()):
+            # The instance is snapshotted while it runs, so what was
+            # written, such as the config, has to reach the disk first.
+            if self._backend.remote_client.manager.flush_volume_cache():
+                self._backend.save_image_cache()
+            else:
+                LOG.warning("The volume cache of the instance can't be "
+                            "flushed, so its image isn't cached.")
+
         LOG.info("Running sysprep...")
 
         self._backend.remote_client.manager.sysprep()
+        # The instance reboots, so the shells and the facts are stale.
+        self._backend.close_remote_clients()
+        self._backend.clear_facts()
 
     def wait_cbinit_finalization(self):
         paths = [
@@ -209,6 +243,8 @@ class CloudbaseinitRecipe(base.BaseCloudbaseinitRecipe):
 class CloudbaseinitScriptRecipe(CloudbaseinitRecipe):
     """A recipe which adds support for testing .exe scripts."""
 
+    resources = CloudbaseinitRecipe.resources + ("windows/test_exe.exe", )
+
     def pre_sysprep(self):
         super(CloudbaseinitScriptRecipe, self).pre_sysprep()
         LOG.info("Doing last step before sysprepping.")
@@ -226,6 +262,8 @@ class CloudbaseinitCreateUserRecipe(CloudbaseinitRecipe):
     works, even when the user which should be created already exists.
     """
 
+    resources = CloudbaseinitRecipe.resources + ("windows/create_user.ps1", )
+
     def pre_sysprep(self):
         super(CloudbaseinitCreateUserRecipe, self).pre_sysprep()
         LOG.info("Creating the user %s...",
@@ -245,10 +283,7 @@ class BaseNextLogonRecipe(CloudbaseinitRecipe):
     def pre_sysprep(self):
         super(BaseNextLogonRecipe, self).pre_sysprep()
 
-        introspection.set_config_option(
-            option="first_logon_behaviour",
-            value=self.behaviour,
-            execute_function=self._execute)
+        self._config.set("first_logon_behaviour", self.behaviour)
 
 
 class AlwaysChangeLogonPasswordRecipe(BaseNextLogonRecipe):
@@ -269,15 +304,21 @@ class CloudbaseinitMockServiceRecipe(CloudbaseinitRecipe):
     config_entry = None
     pattern = "{}"
 
+    @classmethod
+    def _image_cache_facts(cls, conf, service_type=None):
+        facts = super(CloudbaseinitMockServiceRecipe,
+                      cls)._image_cache_facts(conf, service_type)
+        # The address of the service is written in the configuration.
+        facts["service"] = cls.pattern.format(util.get_local_ip())
+        return facts
+
     def pre_sysprep(self):
         super(CloudbaseinitMockServiceRecipe, self).pre_sysprep()
         LOG.info("Inject guest IP for mocked service access.")
 
-        # Append service IP as a config option.
+        # Set the service IP as a config option.
         address = self.pattern.format(util.get_local_ip())
-        introspection.set_config_option(option=self.config_entry,
-                                        value=address,
-                                        execute_function=self._execute)
+        self._config.set(self.config_entry, address)
 
 
 class CloudbaseinitEC2Recipe(CloudbaseinitMockServiceRecipe):
@@ -290,13 +331,15 @@ class CloudbaseinitEC2Recipe(CloudbaseinitMockServiceRecipe):
 class CloudbaseinitCloudstackRecipe(CloudbaseinitMockServiceRecipe):
     """Recipe for Cloudstack metadata service mocking."""
 
+    resources = CloudbaseinitMockServiceRecipe.resources + (
+        "windows/patch_cloudstack.ps1", )
     config_entry = "cloudstack_metadata_ip"
     pattern = "{}:2001"
 
     def pre_sysprep(self):
         super(CloudbaseinitCloudstackRecipe, self).pre_sysprep()
 
-        python_dir = introspection.get_python_dir(self._execute)
+        python_dir = introspection.get_python_dir(self._execute, self._facts)
         cbinit = ntpath.join(python_dir, 'Lib', 'site-packages',
                              'cloudbaseinit')
 
@@ -329,8 +372,7 @@ class CloudbaseinitMaasRecipe(CloudbaseinitMockServiceRecipe):
         )
 
         for field in required_fields:
-            introspection.set_config_option(option=field, value="secret",
-                                            execute_function=self._execute)
+            self._config.set(field, "secret")
 
 
 class CloudbaseinitWinrmRecipe(CloudbaseinitCreateUserRecipe):
@@ -338,13 +380,12 @@ class CloudbaseinitWinrmRecipe(CloudbaseinitCreateUserRecipe):
 
     def pre_sysprep(self):
         super(CloudbaseinitWinrmRecipe, self).pre_sysprep()
-        introspection.set_config_option(
-            option="plugins",
-            value="cloudbaseinit.plugins.windows.winrmcertificateauth."
-                  "ConfigWinRMCertificateAuthPlugin,"
-                  "cloudbaseinit.plugins.windows.winrmlistener."
-                  "ConfigWinRMListenerPlugin",
-            execute_function=self._execute)
+        self._config.set(
+            "plugins",
+            "cloudbaseinit.plugins.windows.winrmcertificateauth."
+            "ConfigWinRMCertificateAuthPlugin,"
+            "cloudbaseinit.plugins.windows.winrmlistener."
+            "ConfigWinRMListenerPlugin")
 
 
 class CloudbaseinitHTTPRecipe(CloudbaseinitMockServiceRecipe):
@@ -360,24 +401,25 @@ class CloudbaseinitKeysRecipe(CloudbaseinitHTTPRecipe,
 
     def pre_sysprep(self):
         super(CloudbaseinitKeysRecipe, self).pre_sysprep()
-        introspection.set_config_option(
-            option="plugins",
-            value="cloudbaseinit.plugins.windows.createuser."
-                  "CreateUserPlugin,"
-                  "cloudbaseinit.plugins.windows.setuserpassword."
-                  "SetUserPasswordPlugin,"
-                  "cloudbaseinit.plugins.common.sshpublickeys."
-                  "SetUserSSHPublicKeysPlugin,"
-                  "cloudbaseinit.plugins.windows.winrmlistener."
-                  "ConfigWinRMListenerPlugin,"
-                  "cloudbaseinit.plugins.windows.winrmcertificateauth."
-                  "ConfigWinRMCertificateAuthPlugin",
-            execute_function=self._execute)
+        self._config.set(
+            "plugins",
+            "cloudbaseinit.plugins.windows.createuser."
+            "CreateUserPlugin,"
+            "cloudbaseinit.plugins.windows.setuserpassword."
+            "SetUserPasswordPlugin,"
+            "cloudbaseinit.plugins.common.sshpublickeys."
+            "SetUserSSHPublicKeysPlugin,"
+            "cloudbaseinit.plugins.windows.winrmlistener."
+            "ConfigWinRMListenerPlugin,"
+            "cloudbaseinit.plugins.windows.winrmcertificateauth."
+            "ConfigWinRMCertificateAuthPlugin")
 
 
 class CloudbaseinitLocalScriptsRecipe(CloudbaseinitRecipe):
     """Recipe for testing local scripts return codes."""
 
+    resources = CloudbaseinitRecipe.resources + ("windows/reboot.cmd", )
+
     def pre_sysprep(self):
         super(CloudbaseinitLocalScriptsRecipe, self).pre_sysprep()
         LOG.info("Download reboot-required local script.")
@@ -391,8 +433,13 @@ class CloudbaseinitLocalScriptsRecipe(CloudbaseinitRecipe):
 class CloudbaseinitImageRecipe(CloudbaseinitRecipe):
     """Calibrate already sys-prepared cloudbase-init images."""
 
+    @classmethod
+    def image_cache_key(cls, conf, **kwargs):
+        # There is nothing to prepare before sysprep.
+        return None
+
     def wait_cbinit_finalization(self):
-        cbdir = introspection.get_cbinit_dir(self._execute)
+        cbdir = introspection.get_cbinit_dir(self._execute, self._facts)
         paths = [ntpath.join(cbdir, "log", name)
                  for name in ["cloudbase-init-unattend.log",
                               "cloudbase-init.log"]]
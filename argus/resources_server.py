@@ -0,0 +1,80 @@
+# Copyright 2016 Cloudbase Solutions Srl
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Serve argus's resources to the instances, over HTTP."""
+
+import multiprocessing
+import os
+import warnings
+
+import cherrypy
+
+from argus import resources
+from argus import util
+
+
+LOG = util.get_logger()
+RESOURCES_DIR = os.path.dirname(os.path.abspath(resources.__file__))
+
+
+def _get_app_config(directory):
+    return {
+        "/": {
+            "tools.staticdir.on": True,
+            "tools.staticdir.dir": directory,
+            # Let the instances revalidate what they already have.
+            "tools.etags.on": True,
+            "tools.etags.autotags": True,
+            "tools.gzip.on": True,
+            "tools.gzip.mime_types": ["text/*", "application/*"],
+        },
+    }
+
+
+def _serve(port, directory):
+    cherrypy.config.update({
+        "server.socket_host": "0.0.0.0",
+        "server.socket_port": port,
+        "log.screen": False,
+    })
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        cherrypy.quickstart(None, "", _get_app_config(directory))
+
+
+@util.run_once
+def get_url(port, host=None):
+    """Get the URL of the served resources, as seen by the instances.
+
+    If *host* isn't given, the address of this host is detected,
+    only once, the next calls returning the same URL.
+    """
+    return "http://{}:{}/".format(host or util.get_local_ip(), port)
+
+
+@util.run_once
+def start_server(port, host=None, directory=RESOURCES_DIR):
+    """Start serving the resources from the given directory.
+
+    The server runs in a separate process, for as long as argus runs.
+    It is started only once, the next calls returning the same process.
+    """
+    LOG.info("Serving the resources from %s at %s.",
+             directory, get_url(port, host))
+    process = multiprocessing.Process(target=_serve,
+                                      args=(port, directory))
+    process.daemon = True
+    process.start()
+    return process
@@ -19,6 +19,8 @@ import unittest
 
 import six
 
+from argus.backends import reaper
+from argus import resources_server
 from argus import util
 
 
@@ -131,6 +133,10 @@ class BaseScenario(unittest.TestCase):
         # so we're just disabling the errors for now.
 
         LOG.info("Running scenario %s", cls.__name__)
+        if cls.conf.argus.serve_resources:
+            resources_server.start_server(cls.conf.argus.resources_port,
+                                          cls.conf.argus.resources_host)
+
         # Create output_directory when given
         if cls.conf.argus.output_directory:
             try:
@@ -138,10 +144,19 @@ class BaseScenario(unittest.TestCase):
             except OSError:
                 LOG.warning("Could not create the output directory.")
 
+        # Delete the resources left behind by the runs which crashed.
+        if cls.conf.argus.teardown_journal:
+            reaper.sweep(cls.conf.argus.teardown_journal)
+
         try:
             cls.backend = cls.backend_type(cls.conf, cls.__name__,
                                            cls.userdata, cls.metadata,
                                            cls.availability_zone)
+            if cls.conf.openstack.image_cache:
+                key = cls.recipe_type.image_cache_key(
+                    cls.conf, **cls.recipe_arguments())
+                if key:
+                    cls.backend.use_image_cache(key)
             cls.backend.setup_instance()
 
             cls.prepare_instance()
@@ -164,13 +179,18 @@ class BaseScenario(unittest.TestCase):
         cls.backend.save_instance_output()
 
     @classmethod
-    def prepare_recipe(cls):
-        """Call the *prepare* method of the underlying recipe
+    def recipe_arguments(cls):
+        """Get the arguments passed to the *prepare* method of the recipe.
 
         This method can be overwritten in the case the recipe's
         *prepare* method needs special arguments passed down.
         """
-        return cls.recipe.prepare()
+        return {}
+
+    @classmethod
+    def prepare_recipe(cls):
+        """Call the *prepare* method of the underlying recipe"""
+        return cls.recipe.prepare(**cls.recipe_arguments())
 
     @classmethod
     def tearDownClass(cls):
@@ -179,5 +199,9 @@ class BaseScenario(unittest.TestCase):
         This usually means that any resource that was created in
         :meth:`setUpClass` needs to be destroyed here.
         """
-        if cls.backend:
-            cls.backend.cleanup()
+        if not cls.backend:
+            return
+        if cls.conf.argus.background_teardown:
+            reaper.get_reaper().submit(cls.backend.teardown)
+        else:
+            cls.backend.teardown()
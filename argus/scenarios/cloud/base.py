@@ -23,6 +23,6 @@ class CloudScenario(base.BaseScenario):
     service_type = 'http'
 
     @classmethod
-    def prepare_recipe(cls):
-        """Prepare the underlying recipe using custom behavior tailored to cloudbaseinit."""
-        return cls.recipe.prepare(service_type=cls.service_type)
+    def recipe_arguments(cls):
+        """Pass the metadata service of the scenario to the recipe."""
+        return {"service_type": cls.service_type}
@@ -15,8 +15,11 @@
 
 """Smoke tests for the cloudbaseinit."""
 
+import ntpath
+
 import pkg_resources
 
+from argus.introspection.cloud import windows as introspection
 from argus.tests import base
 from argus.tests.cloud import smoke
 from argus.tests.cloud import util as test_util
@@ -87,6 +90,23 @@ class TestSmoke(smoke.TestsBaseSmoke):
                 'echo 1', command_type=util.CMD)
         self.assertEqual('1', stdout.strip())
 
+    def test_config_options_in_sections(self):
+        # The shipped cloudbase-init.conf starts with the [DEFAULT]
+        # header, so the options set by the recipe must be under it,
+        # not before the first section header.
+        cbinit_dir = introspection.get_cbinit_dir(
+            self._backend.remote_client.run_command_verbose,
+            self._backend.remote_client.facts)
+        conf = ntpath.join(cbinit_dir, "conf", "cloudbase-init.conf")
+        content = self._introspection.get_instance_file_content(
+            '"{}"'.format(conf))
+
+        lines = [line.strip() for line in content.splitlines()]
+        options = [line for line in lines
+                   if line and not line.startswith(("#", ";"))]
+        self.assertEqual("[DEFAULT]", options[0])
+        self.assertEqual(1, options.count("[DEFAULT]"))
+
     @test_util.skip_unless_dnsmasq_configured
     def test_w32time_triggers(self):
         # Test that w32time has network availability triggers, not
@@ -74,10 +74,21 @@ NETWORK_KEYS = [
 
 
 def get_local_ip():
-    """Get the current machine's IP."""
+    """Get the current machine's IP.
+
+    This is the address of the interface with the default route,
+    or the address of the host name, if there is no such route.
+    No name has to be resolved and nothing is sent.
+    """
     sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    sock.connect(("google.com", 0))
-    return sock.getsockname()[0]
+    try:
+        # Connecting an UDP socket only chooses the route.
+        sock.connect(("192.0.2.1", 9))
+        return sock.getsockname()[0]
+    except socket.error:
+        return socket.gethostbyname(socket.gethostname())
+    finally:
+        sock.close()
 
 
 def next_ip(ip, step=1):